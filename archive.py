@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+### Read results straight out of .tar, .tar.gz, .tar.xz and .tar.zst archives without unpacking them
+###
+### An archive is traversed like a directory: "sorted-results-little-boy.tar.xz/comma-64-bftsmart/run-1/x.out".
+### Paths that do not go through an archive are served by the file system, so the functions below
+### (listdir, scandir, isdir, isfile, exists, stat, open, read, glob, localpath) can replace their os/glob/open counterparts.
+### Outputs cannot be written into archives, outputpath() moves them to a directory named after the archive.
+###
+### The first access to an archive decompresses it once to list its members (symlinks resolve inside the archive)
+### and keeps the contents of the members in memory up to MEMORY_BUDGET bytes, later reads of these members are free.
+### Members beyond the budget are streamed again from the archive when they are opened.
+### Decompression runs in an external multi-threaded tool when one is installed (xz -T0, zstd -T0, pigz).
+
+import builtins
+import contextlib
+import fnmatch
+import gzip
+import glob as globmodule
+import io
+import lzma
+import os
+import posixpath
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import types
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+MEMORY_BUDGET = 2 * 1024**3 # bytes of archive members kept in memory
+MAX_SYMLINKS = 40
+
+SUFFIXES = {
+    ".tar": None,
+    ".tar.gz": "gz",
+    ".tgz": "gz",
+    ".tar.xz": "xz",
+    ".txz": "xz",
+    ".tar.zst": "zst",
+    ".tzst": "zst",
+    ".zst": "zst",
+}
+
+TOOLS = {
+    "xz": [["xz", "-dc", "-T0"]],
+    "gz": [["pigz", "-dc"], ["gzip", "-dc"]],
+    "zst": [["zstd", "-dc", "-T0"]],
+}
+
+
+def compression(path):
+    """ Compression of an archive according to its name, raises KeyError if path is not an archive """
+    for suffix in sorted(SUFFIXES, key=len, reverse=True):
+        if path.endswith(suffix):
+            return SUFFIXES[suffix]
+    raise KeyError(path)
+
+
+def isArchive(path):
+    return any(path.endswith(suffix) for suffix in SUFFIXES) and os.path.isfile(path)
+
+
+@contextlib.contextmanager
+def decompressed(path):
+    """ Binary stream of the tar inside an archive """
+    kind = compression(path)
+
+    if kind is None:
+        with builtins.open(path, "rb") as f:
+            yield f
+        return
+
+    for tool in TOOLS[kind]:
+        if shutil.which(tool[0]) is not None:
+            process = subprocess.Popen(tool + [path], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=1024**2)
+            try:
+                yield process.stdout
+            finally:
+                process.stdout.close()
+                process.kill()
+                process.wait()
+            return
+
+    if kind == "xz":
+        with lzma.open(path) as f:
+            yield f
+    elif kind == "gz":
+        with gzip.open(path) as f:
+            yield f
+    elif zstandard is not None:
+        with builtins.open(path, "rb") as f, zstandard.ZstdDecompressor().stream_reader(f) as reader:
+            yield reader
+    else:
+        raise RuntimeError("Reading {} needs the zstd tool or the zstandard package".format(path))
+
+
+
+
+
+#####
+##### Archives
+#####
+
+class Archive:
+    def __init__(self, path):
+        self.path = path
+        self.members = {} # name -> SimpleNamespace(kind, size, mtime, target)
+        self.children = {"": set()}
+        self.contents = {}
+        self._scan()
+
+    def _add(self, name, kind, size=0, mtime=0, target=None):
+        parent = posixpath.dirname(name)
+        if parent not in self.members and parent != "":
+            self._add(parent, "dir", mtime=mtime)
+        self.children.setdefault(parent, set()).add(posixpath.basename(name))
+        if kind == "dir":
+            self.children.setdefault(name, set())
+        if name not in self.members or kind != "dir":
+            self.members[name] = types.SimpleNamespace(kind=kind, size=size, mtime=mtime, target=target)
+
+    def _scan(self):
+        kept = 0
+        with decompressed(self.path) as stream, tarfile.open(fileobj=stream, mode="r|") as tar:
+            for info in tar:
+                name = posixpath.normpath(info.name).lstrip("/")
+                if name in ("", "."):
+                    continue
+                if info.isdir():
+                    self._add(name, "dir", mtime=info.mtime)
+                elif info.issym():
+                    self._add(name, "symlink", mtime=info.mtime, target=info.linkname)
+                elif info.islnk():
+                    self._add(name, "link", mtime=info.mtime, target="/" + posixpath.normpath(info.linkname).lstrip("/"))
+                elif info.isfile():
+                    self._add(name, "file", size=info.size, mtime=info.mtime)
+                    if kept + info.size <= MEMORY_BUDGET:
+                        self.contents[name] = tar.extractfile(info).read()
+                        kept += info.size
+
+    def resolve(self, name):
+        """ Name of the member behind name once all symlinks are followed, None if it does not exist in the archive """
+        parts = [part for part in name.split("/") if part not in ("", ".")]
+        resolved = ""
+        hops = 0
+
+        while parts:
+            part = parts.pop(0)
+            if part == "..":
+                resolved = posixpath.dirname(resolved)
+                continue
+
+            candidate = posixpath.join(resolved, part) if resolved else part
+            member = self.members.get(candidate)
+            if member is None:
+                return None
+
+            if member.kind in ("symlink", "link"):
+                hops += 1
+                if hops > MAX_SYMLINKS:
+                    return None
+                if member.kind == "link":
+                    target = member.target # hard links are relative to the root of the archive
+                elif member.target.startswith("/"):
+                    return None # absolute symlinks point outside of the archive
+                else:
+                    target = posixpath.join(resolved, member.target)
+                parts = [p for p in target.split("/") if p not in ("", ".")] + parts
+                resolved = ""
+            else:
+                resolved = candidate
+
+        return resolved
+
+    def member(self, name):
+        resolved = self.resolve(name)
+        if resolved is None:
+            raise FileNotFoundError("{} not found in {}".format(name, self.path))
+        return resolved, self.members.get(resolved, types.SimpleNamespace(kind="dir", size=0, mtime=0, target=None))
+
+    def listdir(self, name):
+        resolved, member = self.member(name)
+        if member.kind != "dir":
+            raise NotADirectoryError("{} in {}".format(name, self.path))
+        return sorted(self.children.get(resolved, []))
+
+    def islink(self, name):
+        parent = self.resolve(posixpath.dirname(name))
+        if parent is None:
+            return False
+        member = self.members.get(posixpath.join(parent, posixpath.basename(name)) if parent else posixpath.basename(name))
+        return member is not None and member.kind == "symlink"
+
+    def kind(self, name):
+        resolved = self.resolve(name)
+        if resolved is None:
+            return None
+        return self.members[resolved].kind if resolved in self.members else "dir"
+
+    def open(self, name):
+        """ Binary file object of a member, from memory or streamed from the archive """
+        resolved, member = self.member(name)
+        if member.kind != "file":
+            raise IsADirectoryError("{} in {}".format(name, self.path))
+        if resolved in self.contents:
+            return io.BytesIO(self.contents[resolved])
+
+        stack = contextlib.ExitStack()
+        stream = stack.enter_context(decompressed(self.path))
+        tar = stack.enter_context(tarfile.open(fileobj=stream, mode="r|"))
+        for info in tar:
+            if posixpath.normpath(info.name).lstrip("/") == resolved:
+                return io.BufferedReader(_StreamedMember(tar.extractfile(info), stack), buffer_size=1024**2)
+        stack.close()
+        raise FileNotFoundError("{} disappeared from {}".format(name, self.path))
+
+
+class _StreamedMember(io.RawIOBase):
+    """ Member of an archive read while the archive is decompressed, closing it stops the decompression """
+    def __init__(self, fileobj, stack):
+        self.fileobj = fileobj
+        self.stack = stack
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.fileobj.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.stack.close()
+        super().close()
+
+
+archives = {}
+
+
+def get(path):
+    """ Archive at path, decompressed once per process """
+    path = os.path.abspath(path)
+    if path not in archives:
+        archives[path] = Archive(path)
+    return archives[path]
+
+
+def split(path):
+    """ (archive path, member name) when path goes through an archive, (None, path) otherwise """
+    if not any(suffix in path for suffix in SUFFIXES):
+        return None, path
+
+    parts = os.path.normpath(path).split(os.sep)
+    for i in range(len(parts)):
+        prefix = os.sep.join(parts[:i + 1]) or os.sep
+        if isArchive(prefix):
+            return prefix, "/".join(parts[i + 1:])
+    return None, path
+
+
+
+
+
+#####
+##### Drop-in replacements of os, os.path, glob and open
+#####
+
+def listdir(path):
+    archivePath, name = split(path)
+    if archivePath is None:
+        return os.listdir(path)
+    return get(archivePath).listdir(name)
+
+
+def isdir(path):
+    archivePath, name = split(path)
+    if archivePath is None:
+        return os.path.isdir(path)
+    return get(archivePath).kind(name) == "dir"
+
+
+def isfile(path):
+    archivePath, name = split(path)
+    if archivePath is None:
+        return os.path.isfile(path)
+    return get(archivePath).kind(name) == "file" # the archive itself is a directory
+
+
+def islink(path):
+    archivePath, name = split(path)
+    if archivePath is None:
+        return os.path.islink(path)
+    return name != "" and get(archivePath).islink(name)
+
+
+def exists(path):
+    archivePath, name = split(path)
+    if archivePath is None:
+        return os.path.exists(path)
+    return get(archivePath).kind(name) is not None
+
+
+def stat(path):
+    """ st_size, st_mtime and st_mtime_ns of a file or of an archive member """
+    archivePath, name = split(path)
+    if archivePath is None:
+        return os.stat(path)
+    if name == "":
+        return os.stat(archivePath)
+    _, member = get(archivePath).member(name)
+    return types.SimpleNamespace(st_size=member.size, st_mtime=member.mtime, st_mtime_ns=int(member.mtime * 10**9))
+
+
+class DirEntry:
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return isdir(self.path)
+
+    def is_file(self):
+        return isfile(self.path)
+
+    def is_symlink(self):
+        return islink(self.path)
+
+    def stat(self):
+        return stat(self.path)
+
+
+@contextlib.contextmanager
+def scandir(path):
+    """ Same as os.scandir, also inside archives """
+    archivePath, _ = split(path)
+    if archivePath is None:
+        with os.scandir(path) as it:
+            yield it
+        return
+    yield iter([DirEntry(path, name) for name in listdir(path)])
+
+
+def open(path, mode="r", **kwargs):
+    """ Same as the builtin open (read-only inside archives) """
+    archivePath, name = split(path)
+    if archivePath is None:
+        return builtins.open(path, mode, **kwargs)
+    if any(c in mode for c in "wax+"):
+        raise PermissionError("Archives are read-only: " + path)
+    f = get(archivePath).open(name)
+    return f if "b" in mode else io.TextIOWrapper(f, **kwargs)
+
+
+def read(path):
+    """ All the bytes of a file """
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def glob(pattern):
+    """ Same as glob.glob (without **), also inside archives """
+    if not any(suffix in pattern for suffix in SUFFIXES):
+        return globmodule.glob(pattern)
+
+    parts = pattern.split("/")
+    matches = ["/" if pattern.startswith("/") else ""]
+    for part in [p for p in parts if p != ""]:
+        nextMatches = []
+        for match in matches:
+            if not globmodule.has_magic(part):
+                candidate = os.path.join(match, part)
+                if exists(candidate):
+                    nextMatches.append(candidate)
+            elif match == "" or isdir(match):
+                nextMatches += [os.path.join(match, name) for name in sorted(listdir(match or ".")) if fnmatch.fnmatch(name, part)]
+        matches = nextMatches
+    return matches
+
+
+def outputpath(path):
+    """ Where to write an output next to path: the archive's name without its suffix stands in for the read-only archive """
+    archivePath, name = split(path)
+    if archivePath is None:
+        return path
+
+    for suffix in sorted(SUFFIXES, key=len, reverse=True):
+        if archivePath.endswith(suffix):
+            output = os.path.join(archivePath[:-len(suffix)], name)
+            os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+            return output
+
+
+@contextlib.contextmanager
+def localpath(path):
+    """ Path of a real file with the contents of path, for tools that cannot read from archives """
+    archivePath, _ = split(path)
+    if archivePath is None:
+        yield path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(path)[1]) as f:
+        with open(path, "rb") as member:
+            shutil.copyfileobj(member, f, 1024**2)
+        f.flush()
+        yield f.name
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+### Compact binary container for aggregated distributions (.dist), alternative to the .json intermediates
+###
+### Layout: 8-byte magic, 8-byte little-endian header length, JSON header, then one block per column.
+### Each column is a fixed-width little-endian NumPy array, stored raw or compressed, and aligned on 64 bytes.
+### The header holds the metadata (system, workload, run, scalar results, ...) and the dtype, shape and offset of each column.
+
+import json
+import lzma
+import mmap
+import numpy as np
+import zlib
+
+### local import
+import archive
+
+
+MAGIC = b"CCDIST\x00\x01"
+ALIGNMENT = 64
+
+COMPRESSIONS = {
+    None: (lambda data: data, lambda data: data),
+    "zlib": (zlib.compress, zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+}
+
+
+def toColumn(values):
+    """ Smallest fixed-width little-endian array holding the values without loss """
+    column = np.asarray(values)
+    if column.dtype.kind in "iu" and len(column) > 0 and column.min() >= np.iinfo(np.int32).min and column.max() <= np.iinfo(np.int32).max:
+        column = column.astype(np.int32)
+    elif column.dtype.kind in "iu":
+        column = column.astype(np.int64)
+    else:
+        column = column.astype(np.float64)
+    return column.astype(column.dtype.newbyteorder("<"))
+
+
+def save(filename, columns, metadata={}, compression="zlib"):
+    """
+    Write columns {name: list or array of numbers} and JSON-serializable metadata to filename.
+    Columns are zlib-compressed by default: they trade a single decompression (and copy) on load for a smaller file,
+    only uncompressed columns (compression=None) are mapped without copy on load.
+    """
+    compress = COMPRESSIONS[compression][0]
+
+    blocks = []
+    header = {"metadata": metadata, "columns": {}}
+    for name, values in columns.items():
+        column = toColumn(values)
+        data = compress(column.tobytes())
+        header["columns"][name] = {"dtype": column.dtype.str, "shape": list(column.shape), "compression": compression, "size": len(data)}
+        blocks.append((name, data))
+
+    ### Offsets depend on the header length, which depends on the offsets: reserve room for them first
+    for name in header["columns"]:
+        header["columns"][name]["offset"] = 0
+    headerLength = len(json.dumps(header).encode()) + 32 * (len(blocks) + 1)
+    offset = _align(len(MAGIC) + 8 + headerLength)
+    for name, data in blocks:
+        header["columns"][name]["offset"] = offset
+        offset = _align(offset + len(data))
+
+    headerBytes = json.dumps(header).encode()
+    headerBytes += b" " * (headerLength - len(headerBytes))
+
+    with open(filename, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(headerBytes).to_bytes(8, "little"))
+        f.write(headerBytes)
+        for name, data in blocks:
+            f.seek(header["columns"][name]["offset"])
+            f.write(data)
+
+
+def load(filename):
+    """ Read a .dist file: (metadata, {name: NumPy array}), uncompressed columns are views on the mapped file (or archive member) """
+    if archive.split(filename)[0] is not None:
+        buffer = archive.read(filename)
+    else:
+        with open(filename, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError("Not a distribution file: " + filename)
+    headerLength = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 8], "little")
+    header = json.loads(buffer[len(MAGIC) + 8:len(MAGIC) + 8 + headerLength])
+
+    columns = {}
+    for name, column in header["columns"].items():
+        dtype = np.dtype(column["dtype"])
+        count = int(np.prod(column["shape"]))
+        if count == 0:
+            array = np.zeros(0, dtype=dtype)
+        elif column["compression"] is None:
+            array = np.frombuffer(buffer, dtype=dtype, count=count, offset=column["offset"])
+        else:
+            data = COMPRESSIONS[column["compression"]][1](buffer[column["offset"]:column["offset"] + column["size"]])
+            array = np.frombuffer(data, dtype=dtype, count=count)
+        columns[name] = array.reshape(column["shape"])
+
+    return header["metadata"], columns
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+
+
+
+#####
+##### Layouts of the .json intermediates
+#####
+
+def _isDistribution(values):
+    if isinstance(values, np.ndarray):
+        return values.dtype.kind in "iuf"
+    return isinstance(values, list) and all(isinstance(v, (int, float, np.number)) and not isinstance(v, bool) for v in values)
+
+
+def saveRun(filename, run, metadata={}, compression="zlib"):
+    """
+    Per-run results of the baselines {"throughput-avg": ..., "latency": [...], ...}:
+    lists of numbers become columns, everything else goes to the metadata.
+    """
+    columns = {k: v for k, v in run.items() if _isDistribution(v)}
+    scalars = {k: v for k, v in run.items() if k not in columns}
+    save(filename, columns, dict(metadata, results=scalars), compression)
+
+
+def loadRun(filename):
+    """ Inverse of saveRun: the run dict with NumPy arrays in place of the lists """
+    return _run(*load(filename))
+
+
+def _run(metadata, columns):
+    return dict(metadata["results"], **columns)
+
+
+def saveNested(filename, plot, metadata={}, compression="zlib"):
+    """
+    Chop Chop outputs {system: {workload: [values]}}, or [{field: value}] for line rates:
+    one column per system, workload (and field).
+    """
+    columns = {}
+    keys = []
+    for system in plot:
+        for workload, values in plot[system].items():
+            fields = list(values[0].keys()) if len(values) > 0 and isinstance(values[0], dict) else None
+            if fields is None:
+                columns["{}/{}".format(system, workload)] = values
+            for field in fields or []:
+                columns["{}/{}/{}".format(system, workload, field)] = [v[field] for v in values]
+            keys.append([system, str(workload), fields])
+    save(filename, columns, dict(metadata, keys=keys), compression)
+
+
+def loadNested(filename):
+    """ Inverse of saveNested: {system: {workload: NumPy array or [{field: value}]}} """
+    return _nested(*load(filename))
+
+
+def _nested(metadata, columns):
+    plot = {}
+    for system, workload, fields in metadata["keys"]:
+        plot.setdefault(system, {})
+        if fields is None:
+            plot[system][workload] = columns["{}/{}".format(system, workload)]
+        else:
+            values = [columns["{}/{}/{}".format(system, workload, field)].tolist() for field in fields]
+            plot[system][workload] = [dict(zip(fields, v)) for v in zip(*values)]
+    return plot
+
+
+def loadAny(filename):
+    """ Load a .json or .dist intermediate, whichever the extension says """
+    if filename.endswith(".dist"):
+        metadata, columns = load(filename)
+        return _nested(metadata, columns) if "keys" in metadata else _run(metadata, columns)
+    with archive.open(filename) as f:
+        return json.load(f)
@@ -1,35 +1,366 @@
 #!/usr/bin/env python3
 
-import glob
+from concurrent.futures import ProcessPoolExecutor
+import fnmatch
 import json
-#import numpy as np
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import os
 import re
 import string
 import sys
 
+### local import
+import archive
+import distribution
+import timeline
 
-RUN_LENGTH = 120 # seconds
 
-### subPattern is much slower than searchPattern so we keep them separate for fast search
+RUN_LENGTH = 120 # seconds, only used for logs without timestamps
+WINDOW = "auto" # "auto" measures the steady state of each run (see timeline.py), "all" the whole run, or "START:END" in seconds since the first delivery
+FAST_PATH_MINIMUM = 64 # bytes, smaller logs are always scanned with the patterns
+
+
+def hotstuffTimes(stamps):
+    dates = np.array(stamps, dtype=np.bytes_).astype("datetime64[us]")
+    return np.where(np.isnat(dates), np.nan, dates.astype(np.int64) / 10**6)
+
+
+def bftsmartTimes(stamps):
+    return np.fromiter(map(int, stamps), dtype=np.int64, count=len(stamps)) / 10**3
+
+
+### Fast paths: the matched lines of a log usually all share the layout of the first one. Their fields are then found with NumPy,
+### at fixed offsets or between separators, and parsed a column of characters at a time. scan falls back to the patterns as soon as a line does not fit.
+
+def lineBounds(data):
+    """ Start and end (newline and carriage return excluded) of each line of a non-empty buffer """
+    newlines = np.flatnonzero(data == ord("\n"))
+    starts = np.concatenate(([0], newlines + 1))
+    ends = np.concatenate((newlines, [len(data)]))
+    return starts, ends - ((ends > starts) & (data[np.maximum(ends - 1, 0)] == ord("\r")))
+
+
+def bytesAt(data, positions, needle):
+    """ Whether needle (bytes) is found at each position of a buffer """
+    chars = sliding_window_view(data, len(needle))[positions]
+    found = chars[:, 0] == needle[0]
+    for i in range(1, len(needle)):
+        found &= chars[:, i] == needle[i]
+    return found
+
+
+def integersAt(data, positions, width):
+    """ Integers written with width digits at positions of a buffer, and whether each one has digits only """
+    return integersIn(sliding_window_view(data, width)[positions] - ord("0"))
+
+
+def integersIn(digits):
+    """ Integers written in the rows of a matrix of characters minus "0", and whether each row has digits only """
+    width = digits.shape[1]
+    values = digits[:, 0].astype(np.int64)
+    valid = digits[:, 0] <= 9
+    for i in range(1, width):
+        values *= 10
+        values += digits[:, i]
+        valid &= digits[:, i] <= 9
+    return values, valid
+
+
+def numbersBetween(data, starts, ends, dot=True):
+    """
+    Numbers written in data[start:end] with at most 15 digits (and one dot if dot), and whether each one is.
+
+    The digits make an integer that is divided by 10 to the number of digits after the dot: both are exact floats,
+    and the division rounds exactly as float() does on the text.
+    """
+    lengths = ends - starts
+    valid = (lengths > 0) & (lengths <= 16)
+    width = int(lengths[valid].max(initial=1))
+    valid &= ends >= width
+    lengths = np.where(valid, lengths, 0)
+    chars = sliding_window_view(data, width)[np.where(valid, ends, width) - width] # right-aligned: the number is the last lengths characters
+    chars = np.where(np.arange(width) >= (width - lengths)[:, None], chars, ord("0")) # and zeros before it
+
+    ### Usually all numbers have as many digits after the dot (or none), their digits are then at the same columns
+    dots = np.flatnonzero(chars[np.argmax(valid)] == ord(".")) if dot and valid.any() else []
+    column = dots[0] if len(dots) == 1 else width
+    if column == width and not (dot and (chars == ord(".")).any()):
+        values, digitsOnly = integersIn(chars - ord("0"))
+        return values.astype(np.float64), valid & digitsOnly & (lengths <= 15)
+    if column < width and ((chars[:, column] == ord(".")) | ~valid).all():
+        values, digitsOnly = integersIn(np.delete(chars, column, axis=1) - ord("0"))
+        return values / 10.0 ** (width - 1 - column), valid & digitsOnly & (lengths >= 2)
+
+    ### Otherwise each number is read a character at a time
+    values = np.zeros(len(starts), dtype=np.int64)
+    digitCount, dotCount, fractional = np.zeros((3, len(starts)), dtype=np.int8)
+    for i in range(width):
+        digits = chars[:, i] - ord("0")
+        isDigit = digits <= 9
+        isDot = chars[:, i] == ord(".")
+        valid &= isDigit | isDot
+        np.multiply(values, 10, out=values, where=isDigit)
+        np.add(values, digits, out=values, where=isDigit)
+        fractional += isDigit & (dotCount > 0)
+        digitCount += isDigit & (i >= width - lengths)
+        dotCount += isDot
+    valid &= (dotCount <= 1) & (digitCount > 0) & (digitCount <= 15)
+    return values / 10.0 ** fractional, valid
+
+
+MONTH_DAYS = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+def dateTimes(data, positions, width):
+    """ Seconds since the epoch of the dates "YYYY-MM-DD HH:MM:SS[.ffffff]" of width characters at positions of a buffer, None unless all are valid """
+    if width < 19 or width == 20 or width > 26:
+        return None
+    chars = sliding_window_view(data, width)[positions]
+
+    ### The first 16 characters ("YYYY-MM-DD HH:MM") of consecutive dates seldom change: they are only read where they do
+    heads = np.ascontiguousarray(chars[:, :16]).view(np.uint64)
+    changed = np.concatenate(([True], (heads[1:, 0] != heads[:-1, 0]) | (heads[1:, 1] != heads[:-1, 1])))
+    head = chars[changed]
+    separators = (head[:, 4] == ord("-")) & (head[:, 7] == ord("-")) & ((head[:, 10] == ord(" ")) | (head[:, 10] == ord("T"))) & (head[:, 13] == ord(":"))
+    fields = [integersIn(head[:, start:start + size] - ord("0")) for start, size in [(0, 4), (5, 2), (8, 2), (11, 2), (14, 2)]]
+    if not (separators.all() and all(valid.all() for _, valid in fields)):
+        return None
+    year, month, day, hour, minute = [values for values, _ in fields]
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    if not ((month >= 1) & (month <= 12)).all():
+        return None
+    if not ((day >= 1) & (day <= MONTH_DAYS[month - 1] + ((month == 2) & leap)) & (hour < 24) & (minute < 60)).all():
+        return None
+
+    ### Days since the epoch, counted in years that start in March so that leap days come last
+    shifted = year - (month <= 2)
+    era = shifted // 400
+    yearOfEra = shifted - era * 400
+    dayOfYear = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    days = era * 146097 + yearOfEra * 365 + yearOfEra // 4 - yearOfEra // 100 + dayOfYear - 719468
+    minutes = (days * 1440 + hour * 60 + minute)[np.cumsum(changed) - 1]
+
+    ### Seconds and microseconds of every date
+    second, valid = integersIn(chars[:, 17:19] - ord("0"))
+    valid &= (chars[:, 16] == ord(":")) & (second < 60)
+    fraction = 0
+    if width > 19:
+        fraction, fractionValid = integersIn(chars[:, 20:] - ord("0"))
+        valid &= fractionValid & (chars[:, 19] == ord("."))
+    if not valid.all():
+        return None
+    return ((minutes * 60 + second) * 10**6 + fraction * 10 ** (26 - width)) / 10**6
+
+
+def hotstuffFields(config, buffer):
+    """ Fast path of scan for HotStuff: lines with the mark and the date where the first one has them, None if another line may match """
+    mark = config["mark"]
+    first = buffer.find(mark)
+    if first < 0:
+        return None
+    lineStart = buffer.rfind(b"\n", 0, first) + 1
+    stamp = config["stamp"].match(buffer, lineStart)
+    if stamp is None:
+        return None
+    offset, skip, width = first - lineStart, stamp.start(1) - lineStart, stamp.end(1) - stamp.start(1)
+
+    ### The lines with the mark at the offset of the first one must hold every mark of the log
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    starts, ends = lineBounds(data)
+    long = ends - starts >= offset + len(mark)
+    starts, ends = starts[long], ends[long]
+    marked = bytesAt(data, starts + offset, mark)
+    starts, ends = starts[marked], ends[marked]
+    if len(starts) == 0 or buffer.count(mark) != len(starts):
+        return None
+
+    ### "..., wall: W, cpu: C" or "..., wall: W,...": the value is between the last two commas of a line, after which no " wall: " can be followed by a comma.
+    ### The cpu value is optional: NaN unless " cpu: " follows the last comma.
+    commas = np.flatnonzero(data == ord(","))
+    last = np.searchsorted(commas, ends) - 1
+    after, before = commas[np.maximum(last, 0)], commas[np.maximum(last - 1, 0)]
+    valid = (last >= 1) & (before >= starts + offset + len(mark) - 1) & (after >= before + len(b", wall: ") + 1)
+    valid &= bytesAt(data, np.where(valid, before, 0), b", wall: ")
+    latencies, latencyValid = numbersBetween(data, before + len(b", wall: "), after)
+    hasCpu = valid & (ends > after + len(b", cpu: "))
+    hasCpu &= bytesAt(data, np.where(hasCpu, after, 0), b", cpu: ")
+    cpus, cpuValid = numbersBetween(data, after + len(b", cpu: "), ends)
+    if not (valid & latencyValid & (cpuValid | ~hasCpu)).all():
+        return None
+
+    ### Dates end with "]" or " " as in the stamp pattern
+    after = data[starts + skip + width]
+    times = dateTimes(data, starts + skip, width) if ((after == ord("]")) | (after == ord(" "))).all() else None
+    if times is None:
+        return None
+    return times, {"latency": latencies, "cpu": np.where(hasCpu, cpus, np.nan)}
+
+
+def bftsmartFields(config, buffer):
+    """ Fast path of scan for BFT-SMaRt: lines with " -> " and " = " where the first one has them, None if another line may match """
+    arrow = buffer.find(b" -> ")
+    if arrow < 0:
+        return None
+    lineStart = buffer.rfind(b"\n", 0, arrow) + 1
+    equal = buffer.find(b" = ", arrow)
+    sendWidth, deliveryWidth = arrow - lineStart, equal - arrow - len(b" -> ")
+    if equal < 0 or not (0 < sendWidth <= 18 and 0 < deliveryWidth <= 18):
+        return None
+    latencyStart = equal - lineStart + len(b" = ")
+
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    starts, ends = lineBounds(data)
+    long = ends - starts > latencyStart
+    starts, ends = starts[long], ends[long]
+    lines = bytesAt(data, starts + sendWidth, b" -> ") & bytesAt(data, starts + latencyStart - len(b" = "), b" = ")
+    starts, ends = starts[lines], ends[lines]
+    deliveries, valid = integersAt(data, starts + sendWidth + len(b" -> "), deliveryWidth)
+    valid &= integersAt(data, starts, sendWidth)[1]
+    latencies, latencyValid = numbersBetween(data, starts + latencyStart, ends, dot=False)
+    valid &= latencyValid
+
+    ### Every line the pattern matches has a "->": they are all read here when no other line has one
+    if buffer.count(b"->") != valid.sum():
+        return None
+    return deliveries[valid] / 10**3, {"latency": latencies[valid]}
+
+
+### One precompiled bytes pattern per system captures the values directly, each file is scanned once.
+### The HotStuff pattern starts with the literal "fin decision", which is much faster to search than the date at the start of a line:
+### the date is sliced from the line start instead (see stampTimes).
 hotstuffConfig = {}
+hotstuffConfig["name"] = "hotstuff"
 hotstuffConfig["suffix"] = "err"
-hotstuffConfig["searchPattern"] = r'fin decision.* wall: '
-hotstuffConfig["subPattern"] = r'^.*fin decision.* wall: ([^,]+),.*$'
+hotstuffConfig["pattern"] = re.compile(rb'fin decision[^\n]* wall: ([^,\n]+),(?: cpu: ([0-9.eE+-]+))?')
+hotstuffConfig["mark"] = b"fin decision" # literal start of the pattern
+hotstuffConfig["stamp"] = re.compile(rb'\[?(\d{4}-\d\d-\d\d[ T][\d:.]+)[\] ]') # date at the start of a line
+hotstuffConfig["values"] = ["latency", "cpu"] # seconds of wall-clock and of CPU time
+hotstuffConfig["times"] = hotstuffTimes
+hotstuffConfig["fields"] = hotstuffFields
 # ex: <date> [hotstuff info] got <fin decision=1 cmd_idx=390 cmd_height=31 cmd=88 blk=e11724f422>, wall: 1.408, cpu: 0.010
 
+### BFT-SMaRt lines carry their delivery time in the first group, the pattern starts with the newline before a line
 bftsmartConfig = {}
+bftsmartConfig["name"] = "bftsmart"
 bftsmartConfig["suffix"] = "out"
-bftsmartConfig["searchPattern"] = r'^[0-9]+ -> [0-9]+ = [0-9]+$'
-bftsmartConfig["subPattern"] = r'[0-9]+ -> [0-9]+ = ([0-9]+)$'
-# ex: 1670590989146 -> 1670590989823 = 677
+bftsmartConfig["pattern"] = re.compile(rb'\n[ \t]*[0-9]+ -> ([0-9]+) = ([0-9]+)[ \t\r]*$', re.MULTILINE)
+bftsmartConfig["mark"] = None
+bftsmartConfig["stamp"] = None
+bftsmartConfig["values"] = ["latency"]
+bftsmartConfig["times"] = bftsmartTimes
+bftsmartConfig["fields"] = bftsmartFields
+# ex: 1670590989146 -> 1670590989823 = 677 (send time -> delivery time = latency, in ms)
+
+configs = {"hotstuff": hotstuffConfig, "bftsmart": bftsmartConfig}
+
+
+def findAll(pattern, buffer):
+    """ pattern.findall(buffer) for a pattern that starts with a newline, including a match on the first line """
+    end = buffer.find(b"\n")
+    if end < 0:
+        return pattern.findall(b"\n" + buffer[:])
+    return pattern.findall(b"\n" + buffer[:end]) + pattern.findall(buffer, end)
+
+
+def stampTimes(config, buffer, count):
+    """ Delivery times of the count lines matched by config["pattern"], from the date at the start of each line (NaN if a line has none) """
+    mark = config["mark"]
+    first = buffer.find(mark)
+    if count == 0 or first < 0:
+        return np.full(count, np.nan)
+    lineStart = buffer.rfind(b"\n", 0, first) + 1
+    stamp = config["stamp"].match(buffer, lineStart)
+    if stamp is None:
+        return np.full(count, np.nan) # log without timestamps
+
+    ### Usually every matched line has the layout of the first one: the mark and the date are at fixed offsets from the newline before the line.
+    ### Lines are found with NumPy and their fixed-width dates sliced in bulk, as long as the pattern matched as many lines as have the mark there.
+    offset, skip, width = first - lineStart, stamp.start(1) - lineStart, stamp.end(1) - stamp.start(1)
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    starts = np.flatnonzero(data == ord("\n")) + 1
+    starts = np.concatenate(([0], starts[starts <= len(data) - offset - len(mark)]))
+    starts = starts[sliding_window_view(data, len(mark))[starts + offset].view("S{}".format(len(mark)))[:, 0] == mark]
+    if len(starts) == count:
+        stamps = sliding_window_view(data, width + 1)[starts + skip]
+        if np.all((stamps[:, width] == ord("]")) | (stamps[:, width] == ord(" "))):
+            try:
+                return config["times"](np.ascontiguousarray(stamps[:, :width]).view("S{}".format(width))[:, 0])
+            except ValueError:
+                pass
+
+    ### Otherwise slice each date from the newline before each match
+    stamps = []
+    for match in config["pattern"].finditer(buffer):
+        stamp = config["stamp"].match(buffer, buffer.rfind(b"\n", 0, match.start()) + 1)
+        stamps.append(stamp[1] if stamp is not None else b"")
+    return config["times"](stamps)
+
+
+def scan(config, fileName):
+    """ Delivery times (seconds since the epoch, NaN if the log has none) and {name: values} captured in a file, as NumPy arrays """
+    if archive.split(fileName)[0] is not None:
+        buffer = archive.read(fileName)
+    else:
+        with open(fileName, "rb") as f:
+            buffer = f.read()
 
+    fields = config["fields"](config, buffer) if len(buffer) >= FAST_PATH_MINIMUM else None
+    if fields is not None:
+        return fields
 
-def extract(config, dirNames):
+    if config["stamp"] is None:
+        matches = findAll(config["pattern"], buffer)
+        times = config["times"]([match[0] for match in matches])
+        first = 1
+    else:
+        matches = config["pattern"].findall(buffer)
+        first = 0
+        times = stampTimes(config, buffer, len(matches))
+
+        ### Lines without a date are dropped from a log that has dates
+        dated = ~np.isnan(times)
+        if dated.any() and not dated.all():
+            matches = [match for match, keep in zip(matches, dated) if keep]
+            times = times[dated]
+
+    ### Optional values missing from a line are NaN
+    columns = {}
+    for group, name in enumerate(config["values"], first):
+        values = [match[group] for match in matches]
+        if b"" in values:
+            columns[name] = np.fromiter((float(value) if value else np.nan for value in values), dtype=np.float64, count=len(values))
+        else:
+            columns[name] = np.fromiter(map(float, values), dtype=np.float64, count=len(values))
+    return times, columns
+
+
+def merge(scanned):
+    """ Concatenate the outputs of scan for several files """
+    times = np.concatenate([np.zeros(0)] + [times for times, _ in scanned])
+    columns = {}
+    for _, fileColumns in scanned:
+        for name, values in fileColumns.items():
+            columns.setdefault(name, []).append(values)
+    return times, {name: np.concatenate(values) for name, values in columns.items()}
+
+
+def measurementWindow(relativeTimes, window):
+    """ (start, end) of the window in seconds since the first delivery """
+    runLength = float(relativeTimes.max()) if len(relativeTimes) > 0 else 0.
+    if window == "all":
+        return 0., runLength
+    if window == "auto":
+        steady = timeline.steadyState(timeline.perSecond(relativeTimes))
+        return (float(steady[0]), float(steady[0] + steady[1])) if steady is not None else (0., runLength)
+    start, end = window.split(":")
+    return float(start), float(end)
+
+
+def extract(config, dirNames, outputFormat="json", window=WINDOW):
     ### Find all directory paths
     dirPaths = []
     for dirName in dirNames:
-        if not os.path.isdir(dirName):
+        if not archive.isdir(dirName):
             print("Not a directory: " + dirName)
             return
         path = os.path.relpath(dirName).rstrip('/') # remove righ-most slashes
@@ -38,35 +369,87 @@ def extract(config, dirNames):
     ### Recursively find all client files to parse
     clientFiles = []
     for dirPath in dirPaths:
-        files = glob.glob("{}/*_client_*.{}".format(dirPath, config["suffix"]), recursive=True)
+        files = archive.glob("{}/*_client_*.{}".format(dirPath, config["suffix"]))
         clientFiles = clientFiles + files
     if len(clientFiles) != 80:
         print("Warning: expected 80 files (16 honest clients + 64 load clients) but counted {} files instead.".format(len(clientFiles)))
 
     ### Parse input client files
-    latencies = []
-    for counter, clientFile in enumerate(clientFiles):
-        # print("Parsing file {:03d}/{:03d}: {}".format(counter+1, len(clientFiles), clientFile))
-        with open(clientFile) as f:
-            for line in f:
-                line = line.strip() # Remove return character
-
-                if re.search(config["searchPattern"] , line):
-                    latency = re.sub(config["subPattern"], r'\1', line)
-                    latency = float(latency)
-                    latencies.append(latency)
-
-    throughputAvg = len(latencies)/RUN_LENGTH
-    latencyAvg = sum([v for v in latencies]) / len(latencies) if len(latencies) > 0 else 0
+    times, columns = merge([scan(config, clientFile) for clientFile in clientFiles])
+
+    store(config, dirPaths[0], times, columns, outputFormat, window)
+
+
+def outputFileName(dirPath, outputFormat):
+    prefix = dirPath.rstrip('/') # remove righ-most slashes
+    return archive.outputpath('{}.{}'.format(prefix, outputFormat))
+
+
+def printStalls(dirPath, stalls):
+    if len(stalls) == 0:
+        print("No stall in {}".format(dirPath))
+        return
+    longest = max(stalls, key=lambda stall: stall[1])
+    print("{} stall(s) in {}: {}s in total, longest {}s from {}s".format(len(stalls), dirPath, sum(d for _, d in stalls), longest[1], longest[0]))
+
+
+def store(config, dirPath, times, columns, outputFormat="json", window=WINDOW):
+    latencies = columns.get("latency", np.zeros(0))
+
+    ### Run span from the delivery times, only the deliveries inside the measurement window count
+    timelines = {}
+    if np.isnan(times).any():
+        print("Warning: no timestamps in {}, assuming a run of {} seconds".format(dirPath, RUN_LENGTH))
+        runLength, start, end = float(RUN_LENGTH), 0., float(RUN_LENGTH)
+    else:
+        relativeTimes = times - times.min() if len(times) > 0 else times
+        runLength = float(relativeTimes.max()) if len(times) > 0 else 0.
+        start, end = measurementWindow(relativeTimes, window)
+
+        ### Global timeline of the deliveries of all clients, second by second
+        length = int(runLength) + 1 if len(times) > 0 else 0
+        throughputs = timeline.perSecond(relativeTimes, length=length)
+        percentiles = timeline.percentilesPerSecond(relativeTimes, latencies, [50, 99], length)
+        stalls = timeline.stalls(throughputs)
+        printStalls(dirPath, stalls)
+        timelines['timeline-throughput'] = throughputs.tolist()
+        timelines['timeline-latency-p50'] = percentiles[:, 0].tolist()
+        timelines['timeline-latency-p99'] = percentiles[:, 1].tolist()
+        timelines['stalls'] = [list(stall) for stall in stalls]
+
+        inside = (relativeTimes <= end) if end >= runLength else (relativeTimes < end) # a window up to the end of the run keeps its last delivery
+        columns = {name: values[(relativeTimes >= start) & inside] for name, values in columns.items()}
+        latencies = columns.get("latency", np.zeros(0))
+
+    throughputAvg = len(latencies)/(end - start) if end > start else 0
+    latencyAvg = float(latencies.mean()) if len(latencies) > 0 else 0
     # print("Count: {}\t lat-avg: {}\t throughput-avg: {}".format(len(latencies), latencyAvg, throughputAvg))
 
-    ### Generate and store json
+    ### Generate and store json (or its compact binary equivalent)
     data = {}
     data['throughput-avg'] = throughputAvg
     data['latency-avg'] = latencyAvg
     data['latency'] = latencies
-    prefix = dirPaths[0].rstrip('/') # remove righ-most slashes
-    fileName = '{}.json'.format(prefix)
+    data['run-length'] = runLength
+    data['window'] = [start, end]
+    data.update(timelines) # left out without timestamps: there is no timeline to tell a stall from a run without one
+
+    ### HotStuff reports the CPU time of each command: the rest of its latency is spent waiting
+    if "cpu" in columns:
+        cpus = columns["cpu"]
+        data['cpu-avg'] = float(np.nanmean(cpus)) if not np.isnan(cpus).all() else 0
+        data['cpu'] = cpus
+        data['queueing'] = latencies - cpus
+        data['queueing-avg'] = float(np.nanmean(data['queueing'])) if not np.isnan(cpus).all() else 0
+
+    fileName = outputFileName(dirPath, outputFormat)
+    if outputFormat == "dist":
+        distribution.saveRun(fileName, data, {"system": config["name"], "run": os.path.basename(dirPath.rstrip('/'))})
+        print("Created dist file: " + fileName)
+        return
+    for name in ['latency', 'cpu', 'queueing']:
+        if name in data:
+            data[name] = data[name].tolist()
     with open(fileName, 'w') as f:
         json.dump(data, f)
     print("Created json file: " + fileName)
@@ -74,17 +457,110 @@ def extract(config, dirNames):
 
 
 
+#####
+##### Batch mode over a campaign tree
+#####
+
+def inferSystem(dirPath, names):
+    """ System of a run directory: the deepest path component naming a system, or the suffix of its client files """
+    for component in reversed(dirPath.split('/')):
+        if "bullshark" in component:
+            return None # parsed by extract_bullshark.py
+        for system in configs:
+            if system in component:
+                return system
+    for system, config in configs.items():
+        if fnmatch.filter(names, "*_client_*." + config["suffix"]):
+            return system
+    return None
+
+
+def findRuns(rootPath):
+    """ Run directories below rootPath, i.e. directories that directly contain client files: [(system, dirPath, clientFiles)] """
+    runs = []
+    pending = [rootPath.rstrip('/')]
+    while pending:
+        dirPath = pending.pop()
+        with archive.scandir(dirPath) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        names = [entry.name for entry in entries if entry.is_file()]
+
+        ### Symbolic links to directories only sort runs found elsewhere (or loop back to a parent directory): skip them
+        pending += [entry.path for entry in reversed(entries) if entry.is_dir() and not entry.is_symlink()]
+
+        system = inferSystem(dirPath, names)
+        if system is None:
+            continue
+        files = fnmatch.filter(names, "*_client_*." + configs[system]["suffix"])
+        if files:
+            runs.append((system, dirPath, [dirPath + '/' + name for name in files]))
+
+    return sorted(runs, key=lambda run: run[1])
+
+
+def upToDate(dirPath, clientFiles, outputFormat):
+    """ True if the output of a run is newer than the run directory and all its client files """
+    fileName = outputFileName(dirPath, outputFormat)
+    if not os.path.exists(fileName):
+        return False
+    newest = max(archive.stat(path).st_mtime for path in [dirPath] + clientFiles)
+    return os.stat(fileName).st_mtime > newest
+
+
+def scanTask(task):
+    system, clientFile = task
+    return scan(configs[system], clientFile)
+
+
+def extractBatch(rootPath, outputFormat="json", jobs=os.cpu_count(), window=WINDOW):
+    """ Extract every run below rootPath, parsing the client files of all outdated runs with a pool of jobs processes """
+    runs = findRuns(rootPath)
+    outdated = [run for run in runs if not upToDate(run[1], run[2], outputFormat)]
+    print("Found {} runs in {}: {} up to date, {} to extract".format(len(runs), rootPath, len(runs) - len(outdated), len(outdated)))
+
+    ### Decompress an archive once in the parent, workers inherit it
+    archivePath = archive.split(rootPath)[0]
+    if archivePath is not None:
+        archive.get(archivePath)
+
+    tasks = [(system, clientFile) for system, _, clientFiles in outdated for clientFile in clientFiles]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        values = executor.map(scanTask, tasks, chunksize=4)
+        for system, dirPath, clientFiles in outdated:
+            if len(clientFiles) != 80:
+                print("Warning: expected 80 files (16 honest clients + 64 load clients) in {} but counted {} files instead.".format(dirPath, len(clientFiles)))
+            times, columns = merge([next(values) for _ in clientFiles])
+            store(configs[system], dirPath, times, columns, outputFormat, window)
+
+
+
 #####
 ##### Main
 #####
 
+def option(name, default):
+    """ Value of the last --name=value on the command line """
+    values = [arg.split("=", 1)[1] for arg in sys.argv[1:] if arg.startswith("--{}=".format(name))]
+    return values[-1] if values else default
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 3 or (sys.argv[1] != "bftsmart" and sys.argv[1] != "hotstuff"):
-        print("Expected at least two arguments: <bftsmart|hotstuff> <directories containing all .{err,out} files for one run>")
+    ### Optional --format=json|dist, --window=auto|all|START:END and --jobs=N anywhere on the command line
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    outputFormat = option("format", "json")
+    window = option("window", WINDOW)
+    jobs = option("jobs", str(os.cpu_count()))
+    validOptions = outputFormat in ["json", "dist"] and (window in ["auto", "all"] or re.fullmatch(r'[0-9.]+:[0-9.]+', window) is not None)
+
+    if len(args) == 2 and args[0] == "batch" and validOptions and jobs.isdigit() and int(jobs) > 0:
+        extractBatch(args[1], outputFormat, int(jobs), window)
+        sys.exit(0)
+
+    if len(args) < 2 or (args[0] != "bftsmart" and args[0] != "hotstuff") or not validOptions:
+        print("Expected at least two arguments: <bftsmart|hotstuff> [--format=json|dist] [--window=auto|all|START:END] <directories containing all .{err,out} files for one run>")
+        print("                              or: batch [--format=json|dist] [--window=auto|all|START:END] [--jobs=N] <campaign root containing run directories>")
         sys.exit(1)
 
-    cfg = bftsmartConfig
-    if sys.argv[1] == "hotstuff":
-        cfg = hotstuffConfig
+    cfg = configs[args[0]]
 
-    extract(cfg, sys.argv[2:])
+    extract(cfg, args[1:], outputFormat, window)
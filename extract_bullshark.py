@@ -1,14 +1,20 @@
 # Copyright(C) Facebook, Inc. and its affiliates.
-from os.path import join
+from os.path import basename, join
 from datetime import datetime
-from glob import glob
 import json
 from multiprocessing import Pool
+import numpy as np
 from os.path import join
-from re import findall, search
+import re
+from re import search
 from statistics import mean
 import sys
 
+# local import
+import archive
+import distribution
+import timeline
+
 class BenchError(Exception):
     def __init__(self, message, error):
         assert isinstance(error, Exception)
@@ -160,197 +166,579 @@ class ParseError(Exception):
 
 
 class LogParser:
-    def __init__(self, clients, primaries, workers, faults=0):
-        inputs = [clients, primaries, workers]
+    CORRECT_CLOCK_SKEW = True # subtract the estimated clock offset of each host from its timestamps, when the estimate is tighter than the skew
+    CLOCK_SKEW_WARNING = 0.005 # seconds, warn about runs whose clocks differ more
+    CLOCK_SKEW_BATCHES = 10_000 # batches compared to estimate the delay from primaries to clients
+    CHUNK_SIZE = 1 << 22 # characters of a log read and tokenized at once
+
+    def __init__(self, clients, primaries, workers, faults=0, servers=[]):
+        # Paths of the logs; servers run both a primary and a worker and are read once for both roles.
+        inputs = [clients, primaries, workers, servers]
         assert all(isinstance(x, list) for x in inputs)
         assert all(isinstance(x, str) for y in inputs for x in y)
-        assert all(x for x in inputs)
+        assert clients and (primaries or servers) and (workers or servers)
 
         self.faults = faults
+        nb_primaries = len(servers) + len(primaries)
         if isinstance(faults, int):
-            self.committee_size = len(primaries) + int(faults)
-            self.workers =  len(workers) // len(primaries)
+            self.committee_size = nb_primaries + int(faults)
+            self.workers = (len(servers) + len(workers)) // nb_primaries
         else:
             self.committee_size = '?'
             self.workers = '?'
 
-        # Parse the clients logs.
-        try:
-            with Pool() as p:
-                results = p.map(self._parse_clients, clients)
-        except (ValueError, IndexError, AttributeError) as e:
-            raise ParseError(f'Failed to parse clients\' logs: {e}')
-        self.size, self.rate, self.start, misses, self.sent_samples, \
-            self.true_commits = zip(*results)
+        # Parse all logs on one pool, workers read the files themselves and only send back their results.
+        with Pool() as p:
+            jobs = [
+                ('clients', p.map_async(LogParser._parse_client_file, clients)),
+                ('nodes', p.map_async(LogParser._parse_server_file, servers)),
+                ('nodes', p.map_async(LogParser._parse_primary_file, primaries)),
+                ('workers', p.map_async(LogParser._parse_worker_file, workers)),
+            ]
+            results = []
+            for role, job in jobs:
+                try:
+                    results += [job.get()]
+                except (ValueError, IndexError, AttributeError) as e:
+                    raise ParseError(f'Failed to parse {role}\' logs: {e}')
+        client_results, server_results, primary_results, worker_results = results
+        primary_results = [x for x, _ in server_results] + primary_results
+        worker_results = [x for _, x in server_results] + worker_results
+        self.primary_names = [basename(x) for x in servers + primaries]
+        self.worker_names = [basename(x) for x in servers + workers]
+
+        self.size, self.rate, self.start, misses, self.miss_times, self.sent_samples, \
+            true_commits, targets = zip(*client_results)
+        self._sent = None
         self.misses = sum(misses)
-
-        # Parse the primaries logs.
-        try:
-            with Pool() as p:
-                results = p.map(self._parse_primaries, primaries)
-        except (ValueError, IndexError, AttributeError) as e:
-            raise ParseError(f'Failed to parse nodes\' logs: {e}')
-        proposals, commits, self.configs, primary_ips = zip(*results)
-        self.proposals = self._merge_results([x.items() for x in proposals])
-        self.commits = self._merge_results([x.items() for x in commits])
-
-        # Parse the workers logs.
-        try:
-            with Pool() as p:
-                results = p.map(self._parse_workers, workers)
-        except (ValueError, IndexError, AttributeError) as e:
-            raise ParseError(f'Failed to parse workers\' logs: {e}')
-        sizes, self.received_samples, workers_ips = zip(*results)
-        self.sizes = {
-            k: v for x in sizes for k, v in x.items() if k in self.commits
-        }
+        proposals, commits, self.configs, primary_ips = zip(*primary_results)
+        sizes, received_samples, workers_ips = zip(*worker_results)
+
+        # Batch digests are interned to integer ids once for the whole run: maps keyed by digest
+        # become arrays indexed by id (self.digests[id] is the digest), NaN where a batch was not seen.
+        self.digests, ids = self._intern(
+            [d for d, _ in true_commits + proposals + commits + sizes] +
+            [d for _, d, _ in received_samples]
+        )
+        ids = iter(ids)
+        true_commits = [(next(ids), t) for _, t in true_commits]
+        proposals = [(next(ids), t) for _, t in proposals]
+        commits = [(next(ids), t) for _, t in commits]
+        sizes = [(next(ids), s) for _, s in sizes]
+        self.received_samples = [(s, next(ids), t) for s, _, t in received_samples]
+
+        # Clocks of the hosts differ: estimate their offsets (see _clock_offsets) and remove them from all timestamps.
+        self.client_names = [basename(x) for x in clients]
+        client_offsets, primary_offsets, self.clock_skew = \
+            self._clock_offsets(true_commits, commits, primary_ips, workers_ips, targets)
+        # An offset is only known within the uncertainty: correcting a skew smaller than that would only add noise.
+        # Without any client and host seen both ways the skew is unknown (None), which does not clear a run either.
+        skew, uncertainty = self.clock_skew['skew'], self.clock_skew['uncertainty']
+        self.clock_skew['corrected'] = LogParser.CORRECT_CLOCK_SKEW and skew is not None and 0 <= uncertainty < skew
+        if skew is None:
+            Print.warn('Clock skew unknown: no client and host exchanged both samples and commits')
+        elif skew > LogParser.CLOCK_SKEW_WARNING:
+            Print.warn(
+                f'Clocks differ by up to {self.clock_skew["skew"] * 1_000:,.1f} ms '
+                f'(± {self.clock_skew["uncertainty"] * 1_000:,.1f} ms)'
+                f'{", corrected" if self.clock_skew["corrected"] else ""}'
+            )
+        if self.clock_skew['corrected']:
+            self.start = tuple(x - o for x, o in zip(self.start, client_offsets))
+            self.miss_times = [x - o for x, o in zip(self.miss_times, client_offsets)]
+            self.sent_samples = [(x, t - o) for (x, t), o in zip(self.sent_samples, client_offsets)]
+            true_commits = [(x, t - o) for (x, t), o in zip(true_commits, client_offsets)]
+            proposals = [(x, t - o) for (x, t), o in zip(proposals, primary_offsets)]
+            commits = [(x, t - o) for (x, t), o in zip(commits, primary_offsets)]
+            self._sent = None
+
+        # Clients: earliest commit of each batch seen by each client, sorted by (client, id).
+        keys = np.concatenate([c * len(self.digests) + x for c, (x, _) in enumerate(true_commits)])
+        order = np.argsort(keys)
+        self.true_commits = keys[order], np.concatenate([t for _, t in true_commits])[order]
+
+        # Primaries.
+        self.proposals = self._merge_results(proposals, len(self.digests))
+        self.commits = self._merge_results(commits, len(self.digests))
+        self.primary_commits = commits
+
+        # Workers: batches logged by several workers keep the size of the last one.
+        batches, values = self._latest(
+            np.concatenate([x for x, _ in sizes]), np.concatenate([x for _, x in sizes])
+        )
+        self.sizes = np.zeros(len(self.digests), dtype=np.int64)
+        self.sizes[batches] = values
+        self.worker_batches = sizes
 
         # Determine whether the primary and the workers are collocated.
         self.collocate = set(primary_ips) == set(workers_ips)
 
         # Check whether clients missed their target rate.
         if self.misses != 0:
+            missing = sum(len(x) > 0 for x in self.miss_times)
+            first = min((x.min() for x in self.miss_times if len(x) > 0), default=min(self.start)) - min(self.start)
             Print.warn(
-                f'Clients missed their target rate {self.misses:,} time(s)'
+                f'Clients missed their target rate {self.misses:,} time(s), '
+                f'{missing} of {len(self.miss_times)} client(s) from {first:,.1f} s'
             )
 
-    def _merge_results(self, input):
-        # Keep the earliest timestamp.
-        merged = {}
-        for x in input:
-            for k, v in x:
-                if not k in merged or merged[k] > v:
-                    merged[k] = v
+    @staticmethod
+    def _merge_results(input, length):
+        # Keep the earliest timestamp of each id of [(ids, times)], NaN for ids without any.
+        merged = np.full(length, np.nan)
+        for ids, times in input:
+            np.fmin.at(merged, ids, times)
         return merged
 
-    def _parse_clients(self, log):
-        if search(r'Error', log) is not None:
+    @staticmethod
+    def _earliest(digests, times):
+        # Distinct digests and their earliest timestamp.
+        digests, (ids,) = LogParser._intern([np.array(digests, dtype=np.bytes_)])
+        return digests, LogParser._merge_results([(ids, times)], len(digests))
+
+    @staticmethod
+    def _latest(keys, *values):
+        # Same as dict(zip(keys, values)): distinct keys in order of first appearance, last values of each.
+        _, first = np.unique(keys, return_index=True)
+        _, last = np.unique(keys[::-1], return_index=True)
+        order = np.argsort(first)
+        return (keys[first[order]],) + tuple(x[len(keys) - 1 - last[order]] for x in values)
+
+    @staticmethod
+    def _digest_keys(digests):
+        # 64-bit key of each digest, mixing all its bytes (collisions are detected by _intern).
+        width = -(-digests.itemsize // 8) * 8
+        words = digests.astype(f'S{width}').view(np.uint64).reshape(len(digests), width // 8)
+        keys = np.zeros(len(digests), dtype=np.uint64)
+        for column in range(width // 8):
+            keys = (keys ^ words[:, column]) * np.uint64(0x9E3779B97F4A7C15)
+            keys ^= keys >> np.uint64(29)
+        return keys
+
+    @staticmethod
+    def _intern(groups):
+        # Distinct digests of all groups, and the ids (indexes in them) of the digests of each group.
+        # Digests are sorted by their 64-bit key rather than as strings, which takes a fraction of the
+        # time and memory; the strings are only sorted when two digests share a key.
+        keys, ids = np.unique(np.concatenate([LogParser._digest_keys(x) for x in groups]), return_inverse=True)
+        ids = np.split(ids, np.cumsum([len(x) for x in groups])[:-1])
+        digests = np.zeros(len(keys), dtype=np.result_type(*groups))
+        for group, x in zip(groups, ids):
+            digests[x] = group
+        if not all(np.array_equal(digests[x], group) for group, x in zip(groups, ids)):
+            digests, ids = np.unique(np.concatenate(groups), return_inverse=True)
+            ids = np.split(ids, np.cumsum([len(x) for x in groups])[:-1])
+        return digests, ids
+
+    @staticmethod
+    def _read(filename):
+        # A log as (text, start, end) slices that hold whole lines, each with the newline before it
+        # (see _line): read chunk by chunk, so that the memory of a worker does not grow with the logs.
+        with archive.open(filename, 'r') as f:
+            rest = '\n' # line cut at the end of the previous chunk
+            while True:
+                chunk = f.read(LogParser.CHUNK_SIZE)
+                if not chunk:
+                    break
+                first, last = chunk.find('\n'), chunk.rfind('\n')
+                if first < 0:
+                    rest += chunk
+                    continue
+                rest += chunk[:first]
+                yield rest, 0, len(rest)
+                yield chunk, first, last
+                rest = chunk[last:]
+            yield rest, 0, len(rest)
+
+    @staticmethod
+    def _parse_client_file(filename):
+        return LogParser._parse_clients(LogParser._tokenize(LogParser._read(filename)))
+
+    @staticmethod
+    def _parse_primary_file(filename):
+        return LogParser._parse_primaries(LogParser._tokenize(LogParser._read(filename)))
+
+    @staticmethod
+    def _parse_worker_file(filename):
+        return LogParser._parse_workers(LogParser._tokenize(LogParser._read(filename)))
+
+    @staticmethod
+    def _parse_server_file(filename):
+        tokens = LogParser._tokenize(LogParser._read(filename))
+        return LogParser._parse_primaries(tokens), LogParser._parse_workers(tokens)
+
+    # One match per line: the frequent lines of all roles are classified by the first alternative,
+    # any other line (configs, boot, start, errors, ...) is kept whole for the role that needs it.
+    # Lines start with a newline rather than ^, which lets the regex engine skip to them (see _tokenize).
+    _line = re.compile(r"""
+        \n(?:
+            \[(\S*Z)\ [^\]\n]*\]\ (?:                   # [timestamp level target]
+                Created\ B\d+\(\S+\)\ ->\ (\S+=)          # primary: header proposed
+              | Committed\ B\d+\(\S+\)\ ->\ (\S+=)        # primary: header committed
+              | Batch\ (\S+)\ contains\ (\d+)\ B          # worker: batch size
+              | Batch\ (\S+)\ contains\ sample\ tx\ (\d+) # worker: sample transaction of a batch
+              | Sending\ sample\ transaction\ (\d+)       # client: sample transaction sent
+              | Committed\ ->\ (\S+=)                     # client: batch committed
+            )
+          | (.+)
+        )
+    """, re.X)
+
+    @staticmethod
+    def _tokenize(slices):
+        # Single pass over the slices of a log (see _read), returns the lines of each kind in order of appearance.
+        tokens = {x: [] for x in ['created', 'committed', 'sizes', 'samples', 'sent', 'delivered', 'other']}
+        created, committed, sizes, samples, sent, delivered, other = tokens.values()
+        for text, start, end in slices:
+            for time, c, h, b, n, x, s, t, d, line in LogParser._line.findall(text, start, end):
+                if c:
+                    created.append((time, c))
+                elif h:
+                    committed.append((time, h))
+                elif b:
+                    sizes.append((b, n))
+                elif x:
+                    samples.append((time, x, s))
+                elif t:
+                    sent.append((time, t))
+                elif d:
+                    delivered.append((time, d))
+                else:
+                    other.append(line)
+        return tokens
+
+    @staticmethod
+    def _search(pattern, lines):
+        # First match of pattern in the other lines of a log.
+        for line in lines:
+            match = search(pattern, line)
+            if match is not None:
+                return match
+        return None
+
+    @staticmethod
+    def _parse_clients(tokens):
+        other = tokens['other']
+        if LogParser._search(r'Error', other) is not None:
             raise ParseError('Client(s) panicked')
 
-        size = int(search(r'Transactions size: (\d+)', log).group(1))
-        rate = int(search(r'Transactions rate: (\d+)', log).group(1))
+        size = int(LogParser._search(r'Transactions size: (\d+)', other).group(1))
+        rate = int(LogParser._search(r'Transactions rate: (\d+)', other).group(1))
+
+        tmp = LogParser._search(r'\[(.*Z) .* Start ', other).group(1)
+        start = LogParser._to_posix(tmp)
 
-        tmp = search(r'\[(.*Z) .* Start ', log).group(1)
-        start = self._to_posix(tmp)
+        misses = sum(x.count('rate too high') for x in other)
+        tmp = [search(r'^\[(\S*Z) ', x) for x in other if 'rate too high' in x]
+        miss_times = LogParser._to_posix_array([x.group(1) for x in tmp if x is not None])
 
-        misses = len(findall(r'rate too high', log))
+        tmp = tokens['sent']
+        times = LogParser._to_posix_array([t for t, _ in tmp])
+        samples = LogParser._latest(np.fromiter((s for _, s in tmp), dtype=np.int64, count=len(tmp)), times)
 
-        tmp = findall(r'\[(.*Z) .* sample transaction (\d+)', log)
-        samples = {int(s): self._to_posix(t) for t, s in tmp}
+        tmp = tokens['delivered']
+        times = LogParser._to_posix_array([t for t, _ in tmp])
+        true_commits = LogParser._earliest([d for _, d in tmp], times)
 
-        tmp = findall(r'\[(.*Z) .* Committed -> ([^ ]+=)', log)
-        tmp = [(d, self._to_posix(t)) for t, d in tmp]
-        true_commits = self._merge_results([tmp]) 
+        # IP of the worker the client sends to, when it is logged.
+        tmp = LogParser._search(r'Node address: (\d+.\d+.\d+.\d+)', other)
+        target = tmp.group(1) if tmp is not None else None
 
-        return size, rate, start, misses, samples, true_commits
+        return size, rate, start, misses, miss_times, samples, true_commits, target
 
-    def _parse_primaries(self, log):
-        if search(r'(?:panicked|Error)', log) is not None:
+    @staticmethod
+    def _parse_primaries(tokens):
+        other = tokens['other']
+        if LogParser._search(r'(?:panicked|Error)', other) is not None:
             raise ParseError('Primary(s) panicked')
 
-        tmp = findall(r'\[(.*Z) .* Created B\d+\([^ ]+\) -> ([^ ]+=)', log)
-        tmp = [(d, self._to_posix(t)) for t, d in tmp]
-        proposals = self._merge_results([tmp])
+        tmp = tokens['created']
+        times = LogParser._to_posix_array([t for t, _ in tmp])
+        proposals = LogParser._earliest([d for _, d in tmp], times)
 
-        tmp = findall(r'\[(.*Z) .* Committed B\d+\([^ ]+\) -> ([^ ]+=)', log)
-        tmp = [(d, self._to_posix(t)) for t, d in tmp]
-        commits = self._merge_results([tmp])
+        tmp = tokens['committed']
+        times = LogParser._to_posix_array([t for t, _ in tmp])
+        commits = LogParser._earliest([d for _, d in tmp], times)
 
         configs = {
             'header_size': int(
-                search(r'Header size .* (\d+)', log).group(1)
+                LogParser._search(r'Header size .* (\d+)', other).group(1)
             ),
             'max_header_delay': int(
-                search(r'Max header delay .* (\d+)', log).group(1)
+                LogParser._search(r'Max header delay .* (\d+)', other).group(1)
             ),
             'gc_depth': int(
-                search(r'Garbage collection depth .* (\d+)', log).group(1)
+                LogParser._search(r'Garbage collection depth .* (\d+)', other).group(1)
             ),
             'sync_retry_delay': int(
-                search(r'Sync retry delay .* (\d+)', log).group(1)
+                LogParser._search(r'Sync retry delay .* (\d+)', other).group(1)
             ),
             'sync_retry_nodes': int(
-                search(r'Sync retry nodes .* (\d+)', log).group(1)
+                LogParser._search(r'Sync retry nodes .* (\d+)', other).group(1)
             ),
             'batch_size': int(
-                search(r'Batch size .* (\d+)', log).group(1)
+                LogParser._search(r'Batch size .* (\d+)', other).group(1)
             ),
             'max_batch_delay': int(
-                search(r'Max batch delay .* (\d+)', log).group(1)
+                LogParser._search(r'Max batch delay .* (\d+)', other).group(1)
             ),
         }
 
-        ip = search(r'booted on (\d+.\d+.\d+.\d+)', log).group(1)
+        ip = LogParser._search(r'booted on (\d+.\d+.\d+.\d+)', other).group(1)
 
         return proposals, commits, configs, ip
 
-    def _parse_workers(self, log):
-        if search(r'(?:panic|Error)', log) is not None:
+    @staticmethod
+    def _parse_workers(tokens):
+        other = tokens['other']
+        if LogParser._search(r'(?:panic|Error)', other) is not None:
             raise ParseError('Worker(s) panicked')
 
-        tmp = findall(r'Batch ([^ ]+) contains (\d+) B', log)
-        sizes = {d: int(s) for d, s in tmp}
+        tmp = tokens['sizes']
+        sizes = LogParser._latest(
+            np.array([d for d, _ in tmp], dtype=np.bytes_),
+            np.fromiter((s for _, s in tmp), dtype=np.int64, count=len(tmp))
+        )
 
-        tmp = findall(r'Batch ([^ ]+) contains sample tx (\d+)', log)
-        samples = {int(s): d for d, s in tmp}
+        tmp = tokens['samples']
+        samples = LogParser._latest(
+            np.fromiter((s for _, _, s in tmp), dtype=np.int64, count=len(tmp)),
+            np.array([d for _, d, _ in tmp], dtype=np.bytes_),
+            LogParser._to_posix_array([t for t, _, _ in tmp])
+        )
 
-        ip = search(r'booted on (\d+.\d+.\d+.\d+)', log).group(1)
+        ip = LogParser._search(r'booted on (\d+.\d+.\d+.\d+)', other).group(1)
 
         return sizes, samples, ip
 
-    def _to_posix(self, string):
+    @staticmethod
+    def _to_posix(string):
         x = datetime.fromisoformat(string.replace('Z', '+00:00'))
         return datetime.timestamp(x)
 
+    _minutes = {} # 'YYYY-MM-DDTHH:MM' -> POSIX time of that minute, shared by consecutive timestamps of a log
+
+    @staticmethod
+    def _to_posix_array(strings):
+        # Same as _to_posix for a whole list of 'YYYY-MM-DDTHH:MM:SS[.ffffff]Z' timestamps at once.
+        # Times are summed in integer microseconds, so the result is exactly the one of _to_posix.
+        if not strings:
+            return np.zeros(0)
+        raw = np.array(strings, dtype=np.bytes_)
+        chars = raw.view(np.uint8).reshape(len(raw), raw.itemsize)
+        if raw.itemsize < 20 or np.any(chars[:, 16] != ord(':')) or np.any((chars[:, 19] != ord('.')) & (chars[:, 19] != ord('Z'))):
+            return np.array([LogParser._to_posix(x) for x in strings])
+
+        # Date, hour and minute: one conversion per distinct minute, looked up once per run of equal minutes.
+        prefixes = raw.astype('S16')
+        starts = np.flatnonzero(np.concatenate(([True], prefixes[1:] != prefixes[:-1])))
+        for prefix in prefixes[starts].tolist():
+            if prefix not in LogParser._minutes:
+                LogParser._minutes[prefix] = round(LogParser._to_posix(prefix.decode() + ':00Z'))
+        minutes = np.array([LogParser._minutes[x] for x in prefixes[starts].tolist()], dtype=np.int64)
+        minutes = np.repeat(minutes, np.diff(np.append(starts, len(raw))))
+
+        # Seconds and up to 6 digits of fraction ('Z' and the padding are not digits).
+        seconds = (chars[:, 17].astype(np.int64) - ord('0')) * 10 + chars[:, 18] - ord('0')
+        micros = np.zeros(len(raw), dtype=np.int64)
+        for column, scale in zip(range(20, 26), [10**5, 10**4, 10**3, 10**2, 10, 1]):
+            if column < raw.itemsize:
+                digit = chars[:, column].astype(np.int64) - ord('0')
+                micros += np.where((digit >= 0) & (digit <= 9), digit, 0) * scale
+
+        return ((minutes + seconds) * 10**6 + micros) / 10**6
+
     def _consensus_throughput(self):
-        if not self.commits:
+        committed = ~np.isnan(self.commits)
+        if not committed.any():
             return 0, 0, 0
-        start, end = min(self.proposals.values()), max(self.commits.values())
+        start, end = float(np.nanmin(self.proposals)), float(np.nanmax(self.commits))
         duration = end - start
-        bytes = sum(self.sizes.values())
+        bytes = int(self.sizes[committed].sum())
         print(bytes)
         bps = bytes / duration
         tps = bps / self.size[0]
         return tps, bps, duration
 
     def _consensus_latency(self):
-        latency = [c - self.proposals[d] for d, c in self.commits.items() if d in self.proposals]
-        return mean(latency) if latency else 0
+        # Earliest proposal to earliest commit of each batch by the primaries.
+        latency = self.commits - self.proposals
+        return latency[~np.isnan(latency)].tolist()
 
     def _end_to_end_throughput(self):
-        if not self.commits:
+        committed = ~np.isnan(self.commits)
+        if not committed.any():
             return 0, 0, 0
-        start, end = min(self.start), max(self.commits.values())
+        start, end = min(self.start), float(np.nanmax(self.commits))
         duration = end - start
-        bytes = sum(self.sizes.values())
+        bytes = int(self.sizes[committed].sum())
         bps = bytes / duration
         tps = bps / self.size[0]
         return tps, bps, duration
 
+    def _clock_offsets(self, true_commits, commits, primary_ips, workers_ips, targets):
+        # Clock offset of each client and of each primary, in seconds, relative to their mean.
+        # Samples go from a client to a worker and commits from a primary to a client: for a client and a server
+        # (a host running a primary and a worker, by IP), the shortest delays d1 = offset + t1 and d2 = t2 - offset
+        # seen in each direction give offset = (d1 - d2) / 2 when the one-way times t1 and t2 match,
+        # within (d1 + d2) / 2. Offsets of the pairs are then reconciled by least squares.
+        # Clients number their samples independently, so a received sample matches the samples of several clients:
+        # it is attributed to the one that sent it last before it was received (or first after, if none did), and
+        # each client to the host it sends to, logged or else the one most of its attributed samples went to.
+        # A pair whose round trip d1 + d2 is not positive is inconsistent (a commit matched the wrong message) and left out.
+        hosts = sorted(set(primary_ips) & set(workers_ips))
+        nb_clients, nb_hosts = len(self.sent_samples), len(hosts)
+
+        # Samples: sent by a client, then sealed in a batch by a worker.
+        forward = np.full((nb_clients, nb_hosts), np.nan)
+        worker_hosts = np.array([hosts.index(x) if x in hosts else -1 for x in workers_ips])
+        _, rows, clients, starts = self._join_samples()
+        workers = np.repeat(np.arange(len(self.received_samples)), [len(x) for x, _, _ in self.received_samples])[rows]
+        received = np.concatenate([t for _, _, t in self.received_samples])[rows]
+        sent_hosts = worker_hosts[workers]
+        targets = np.array([hosts.index(x) if x in hosts else -1 for x in targets])
+        candidates = (sent_hosts >= 0) & ((targets[clients] < 0) | (targets[clients] == sent_hosts))
+        rows, clients, sent_hosts, delays = rows[candidates], clients[candidates], sent_hosts[candidates], (received - starts)[candidates]
+        order = np.lexsort((np.abs(delays), delays < 0, rows)) # per received sample: shortest delay, negative ones last
+        chosen = order[np.flatnonzero(np.diff(rows[order], prepend=-1))]
+        clients, sent_hosts, delays = clients[chosen], sent_hosts[chosen], delays[chosen]
+        counts = np.zeros((nb_clients, nb_hosts), dtype=np.int64)
+        np.add.at(counts, (clients, sent_hosts), 1)
+        client_hosts = np.where(targets >= 0, targets, np.argmax(counts, axis=1) if nb_hosts else -1)
+        keep = sent_hosts == client_hosts[clients]
+        np.fmin.at(forward, (clients[keep], sent_hosts[keep]), delays[keep])
+
+        # Commits: by a primary, then seen by a client. Ids are in random order, the first ones are a random subset.
+        backward = np.full((nb_clients, nb_hosts), np.nan)
+        limit = min(len(self.digests), LogParser.CLOCK_SKEW_BATCHES)
+        seen = [(c, x < limit) for c, (x, _) in enumerate(true_commits)]
+        seen_clients = np.concatenate([np.full(np.count_nonzero(x), c) for c, x in seen])
+        seen_ids = np.concatenate([ids[x] for (ids, _), (_, x) in zip(true_commits, seen)])
+        seen_times = np.concatenate([times[x] for (_, times), (_, x) in zip(true_commits, seen)])
+        for ip, (ids, times) in zip(primary_ips, commits):
+            if ip in hosts:
+                committed = np.full(limit, np.nan)
+                committed[ids[ids < limit]] = times[ids < limit]
+                delays = np.full(nb_clients, np.nan)
+                np.fmin.at(delays, seen_clients, seen_times - committed[seen_ids])
+                backward[:, hosts.index(ip)] = np.fmin(backward[:, hosts.index(ip)], delays)
+
+        # Offsets of clients then hosts: one equation per pair seen both ways, plus a zero mean. A client usually sends to
+        # a single host, which leaves each client and its host unrelated to the others: the commits it sees from every
+        # primary relate them, as backward delays d2 = tau + offset(client) - offset(host) where tau, the shortest time
+        # from a commit by any primary to the client, is one more unknown per client.
+        pairs = np.argwhere(forward + backward > 0) # NaN where a way was not seen
+        offsets = np.zeros(nb_clients + nb_hosts)
+        report = {'offsets': {}, 'skew': None, 'uncertainty': None}
+        if len(pairs) > 0:
+            clients, hosts_ = pairs[:, 0], pairs[:, 1]
+            seen = np.argwhere(~np.isnan(backward))
+            seen = seen[np.isin(seen[:, 0], clients)]
+            used = np.union1d(clients, nb_clients + np.union1d(hosts_, seen[:, 1]))
+            equations = np.zeros((len(pairs) + len(seen) + 1, 2 * nb_clients + nb_hosts))
+            equations[np.arange(len(pairs)), nb_clients + hosts_] = 1
+            equations[np.arange(len(pairs)), clients] = -1
+            rows = len(pairs) + np.arange(len(seen))
+            equations[rows, nb_clients + seen[:, 1]] = 1
+            equations[rows, seen[:, 0]] = -1
+            equations[rows, nb_clients + nb_hosts + seen[:, 0]] = -1
+            equations[-1, used] = 1
+            differences = np.concatenate(((forward - backward)[clients, hosts_] / 2, -backward[seen[:, 0], seen[:, 1]], [0]))
+            offsets = np.linalg.lstsq(equations, differences, rcond=None)[0][:nb_clients + nb_hosts]
+            names = self.client_names + hosts
+            report = {
+                'offsets': {names[x]: float(offsets[x]) for x in used},
+                'skew': float(offsets[used].max() - offsets[used].min()),
+                'uncertainty': float(np.median((forward + backward)[clients, hosts_] / 2)),
+            }
+
+        primary_offsets = [offsets[nb_clients + hosts.index(x)] if x in hosts else 0 for x in primary_ips]
+        return offsets[:nb_clients], primary_offsets, report
+
+    def _timelines(self):
+        # Committed bytes per second since the first client started: of the whole run (each batch
+        # counted once, at its earliest commit), of each worker (its batches) and of each primary
+        # (the batches it committed); the times each client missed its rate per second, over the
+        # same seconds; and the steady-state window of the whole run (see timeline.py).
+        origin = min(self.start)
+        committed = ~np.isnan(self.commits)
+        length = int(np.floor(np.nanmax(self.commits) - origin)) + 1 if committed.any() else 0
+        run = timeline.perSecond(self.commits[committed] - origin, self.sizes[committed], length)
+
+        workers = []
+        for ids, sizes in self.worker_batches:
+            times = self.commits[ids]
+            workers += [timeline.perSecond(times[~np.isnan(times)] - origin, sizes[~np.isnan(times)], length)]
+        primaries = [timeline.perSecond(times - origin, self.sizes[ids], length) for ids, times in self.primary_commits]
+        misses = [timeline.perSecond(times - origin, length=length) for times in self.miss_times]
+
+        return run, workers, primaries, misses, timeline.steadyState(run)
+
+    def _steady_throughput(self, run, window):
+        # Throughput over the steady-state window, over the whole run when there is none.
+        if window is None:
+            return self._end_to_end_throughput()
+        start, duration = window
+        bps = float(run[start:start + duration].sum()) / duration
+        tps = bps / self.size[0]
+        return tps, bps, duration
+
+    def _batch_fill(self, batch_size):
+        # Fill ratio of the batches sealed by each worker against the configured batch size. The
+        # batch maker seals a batch once it reaches batch_size, and on max_batch_delay otherwise:
+        # smaller batches were sealed by the timeout.
+        fills = [sizes / batch_size for _, sizes in self.worker_batches]
+        workers = {
+            name: {
+                'batches': len(x),
+                'fill-avg': float(x.mean()) if len(x) else 0,
+                'timeout-share': float((x < 1).mean()) if len(x) else 0,
+                'fill-percentiles': np.percentile(x, [5, 50, 95]).tolist() if len(x) else [],
+            } for name, x in zip(self.worker_names, fills)
+        }
+        fill = np.concatenate(fills) if fills else np.zeros(0)
+        return fill, workers
+
+    def _sent_index(self):
+        # Sample transactions sorted by tx_id, then client: (tx_ids, clients, send times), built once.
+        if self._sent is None:
+            tx_ids = np.concatenate([x for x, _ in self.sent_samples])
+            starts = np.concatenate([x for _, x in self.sent_samples])
+            clients = np.repeat(np.arange(len(self.sent_samples)), [len(x) for x, _ in self.sent_samples])
+            order = np.argsort(tx_ids, kind='stable')
+            self._sent = tx_ids[order], clients[order], starts[order]
+        return self._sent
+
+    def _join_samples(self):
+        # Join the received samples (tx_id -> batch id) with the sent samples (tx_id -> send time).
+        # Returns one row per match, in the order of the received samples then of the clients:
+        # (batch id of each received sample, index of the received sample, client, send time).
+        tx_ids, clients, starts = self._sent_index()
+        received = np.concatenate([x for x, _, _ in self.received_samples])
+        batches = np.concatenate([x for _, x, _ in self.received_samples])
+
+        first = np.searchsorted(tx_ids, received, side='left')
+        counts = np.searchsorted(tx_ids, received, side='right') - first
+        rows = np.repeat(np.arange(len(received)), counts)
+        matches = np.repeat(first - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return batches, rows, clients[matches], starts[matches]
+
     def _end_to_end_latency(self):
-        latency = []
-        for received in self.received_samples:
-            for tx_id, batch_id in received.items():
-                if batch_id in self.commits:
-                    for sent in self.sent_samples:
-                        if tx_id in sent:
-                            start = sent[tx_id]
-                            end = self.commits[batch_id]
-                            latency += [end-start]
-        return latency if latency else [-1]
+        # Send time of each sample to the commit time of its batch by the primaries.
+        batches, rows, _, starts = self._join_samples()
+        ends = self.commits[batches][rows]
+        return (ends - starts)[~np.isnan(ends)].tolist()
 
     def _true_end_to_end_latency(self):
-        latency = []
-        for received in self.received_samples:
-            for tx_id, batch_id in received.items():
-                for (sent, commits) in zip(self.sent_samples, self.true_commits):
-                    if batch_id in commits and tx_id in sent:
-                        start = sent[tx_id]
-                        end = commits[batch_id]
-                        latency += [end-start]
-        return latency if latency else [-1]
-
-    def result(self):
+        # Send time of each sample to the commit time of its batch seen by the client that sent it.
+        batches, rows, clients, starts = self._join_samples()
+        keys, times = self.true_commits
+        wanted = clients * len(self.digests) + batches[rows]
+        found = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        ends = np.where(keys[found] == wanted, times[found], np.nan) if len(keys) > 0 else np.full(len(wanted), np.nan)
+        return (ends - starts)[~np.isnan(ends)].tolist()
+
+    def result(self, prefix=None, output_format='json'):
         header_size = self.configs[0]['header_size']
         max_header_delay = self.configs[0]['max_header_delay']
         gc_depth = self.configs[0]['gc_depth']
@@ -359,29 +747,98 @@ class LogParser:
         batch_size = self.configs[0]['batch_size']
         max_batch_delay = self.configs[0]['max_batch_delay']
 
-        consensus_latency = self._consensus_latency() * 1_000
+        consensus_latency_values = self._consensus_latency()                        # all values, can compute percentiles from this
+        consensus_latency = mean(consensus_latency_values) * 1_000 if consensus_latency_values else 0
         consensus_tps, consensus_bps, _ = self._consensus_throughput()
         end_to_end_tps, end_to_end_bps, duration = self._end_to_end_throughput()
         end_to_end_latency_values = self._end_to_end_latency()                      # all values, can compute percentiles from this
         true_end_to_end_latency_values = self._true_end_to_end_latency()            # all values, can compute percentiles from this
-        end_to_end_latency = mean(end_to_end_latency_values) * 1_000
-        true_end_to_end_latency = mean(true_end_to_end_latency_values) * 1_000
+        end_to_end_latency = mean(end_to_end_latency_values) * 1_000 if end_to_end_latency_values else 0
+        true_end_to_end_latency = mean(true_end_to_end_latency_values) * 1_000 if true_end_to_end_latency_values else 0
 
         estimated_tps = int(float(64)/float(len(self.received_samples)) * float(end_to_end_tps))
 
+        run, workers, primaries, misses, window = self._timelines()
+        steady_tps, _, steady_duration = self._steady_throughput(run, window)
+        if window is None:
+            Print.warn('No steady state found, throughput measured over the whole run')
+            window = (0, duration)
+
         # PLR: export to json to make it easier to import and to add latency distribution
         json_data = {}
-        json_data['throughput-avg'] = round(end_to_end_tps)
+        json_data['throughput-avg'] = round(steady_tps)
         json_data['latency-avg'] = round(true_end_to_end_latency)
         json_data['latency'] = true_end_to_end_latency_values
-        prefix = sys.argv[1].rstrip('/') # remove righ-most slashes
-        filename = '{}.easier-log.json'.format(prefix)
-        with open(filename, 'w') as f:
-            json.dump(json_data, f)
+        json_data['run-length'] = duration
+        json_data['window'] = [window[0], window[0] + window[1]]
+        json_data['timeline-throughput'] = (run / self.size[0]).tolist()
+        json_data['timeline-bytes'] = run.tolist()
+        json_data['timeline-workers'] = {
+            name: {'bytes': x.tolist(), 'tx': (x / self.size[0]).tolist()} for name, x in zip(self.worker_names, workers)
+        }
+        json_data['timeline-primaries'] = {
+            name: {'bytes': x.tolist(), 'tx': (x / self.size[0]).tolist()} for name, x in zip(self.primary_names, primaries)
+        }
+
+        # Everything else of the summary: configs, consensus and whole-run end-to-end metrics (latencies in seconds, averages in ms).
+        json_data['config'] = {
+            'faults': self.faults,
+            'committee_size': self.committee_size,
+            'workers': self.workers,
+            'collocate': self.collocate,
+            'rate': sum(self.rate),
+            'tx_size': self.size[0],
+            **self.configs[0],
+        }
+        json_data['consensus-throughput-avg'] = consensus_tps
+        json_data['consensus-bps'] = consensus_bps
+        json_data['consensus-latency-avg'] = consensus_latency
+        json_data['consensus-latency'] = consensus_latency_values
+        json_data['end-to-end-throughput-avg'] = end_to_end_tps
+        json_data['end-to-end-bps'] = end_to_end_bps
+        json_data['end-to-end-latency-avg'] = end_to_end_latency
+        json_data['end-to-end-latency'] = end_to_end_latency_values
+        json_data['estimated-tps'] = estimated_tps
+        json_data['misses'] = self.misses
+
+        # Clients that could not sustain their input rate: when, and inside the measurement window.
+        json_data['timeline-misses'] = {name: x.tolist() for name, x in zip(self.client_names, misses)}
+        missed = np.sum(misses, axis=0) if misses else np.zeros(0)
+        misses_in_window = int(missed[int(window[0]):int(np.ceil(window[0] + window[1]))].sum())
+        json_data['misses-in-window'] = misses_in_window
+        json_data['saturation-start'] = int(np.flatnonzero(missed)[0]) if missed.any() else None
+        json_data['saturated-clients'] = [name for name, x in zip(self.client_names, misses) if x.any()]
+
+        # Batch sealing of the workers: fill ratio against batch_size, and share sealed by the timeout.
+        batch_fill, batch_workers = self._batch_fill(batch_size)
+        json_data['batch-fill'] = batch_fill.tolist()
+        json_data['batch-fill-avg'] = float(batch_fill.mean()) if len(batch_fill) else 0
+        json_data['batch-timeout-share'] = float((batch_fill < 1).mean()) if len(batch_fill) else 0
+        json_data['batch-workers'] = batch_workers
+
+        json_data['clock-offsets'] = self.clock_skew['offsets']
+        json_data['clock-skew'] = self.clock_skew['skew']
+        json_data['clock-uncertainty'] = self.clock_skew['uncertainty']
+        json_data['clock-corrected'] = self.clock_skew['corrected']
+        if self.clock_skew['skew'] is None:
+            clock_skew = 'unknown'
+        else:
+            clock_skew = (
+                f'{self.clock_skew["skew"] * 1_000:,.1f} ms (± {self.clock_skew["uncertainty"] * 1_000:,.1f} ms, '
+                f'{"corrected" if self.clock_skew["corrected"] else "not corrected"})'
+            )
+        prefix = (prefix or sys.argv[1]).rstrip('/') # remove righ-most slashes
+        if output_format == 'dist':
+            filename = archive.outputpath('{}.easier-log.dist'.format(prefix))
+            distribution.saveRun(filename, json_data, {'system': 'bullshark', 'run': prefix.split('/')[-1]})
+        else:
+            filename = archive.outputpath('{}.easier-log.json'.format(prefix))
+            with open(filename, 'w') as f:
+                json.dump(json_data, f)
 
         return (
             '\n'
-            f'Added json file: {filename}\n'
+            f'Added {output_format} file: {filename}\n'
             '\n'
             '-----------------------------------------\n'
             ' SUMMARY:\n'
@@ -402,6 +859,7 @@ class LogParser:
             f' Sync retry nodes: {sync_retry_nodes:,} node(s)\n'
             f' batch size: {batch_size:,} B\n'
             f' Max batch delay: {max_batch_delay:,} ms\n'
+            f' Clock skew: {clock_skew}\n'
             '\n'
             ' + RESULTS:\n'
             f' Consensus TPS: {round(consensus_tps):,} tx/s\n'
@@ -411,8 +869,14 @@ class LogParser:
             f' End-to-end TPS: {round(end_to_end_tps):,} tx/s\n'
             f' Estimated TPS: {round(estimated_tps):,} tx/s\n'
             f' End-to-end BPS: {round(end_to_end_bps):,} B/s\n'
+            f' Steady-state TPS: {round(steady_tps):,} tx/s ({round(steady_duration):,} s from {round(window[0]):,} s)\n'
             f' End-to-end latency: {round(end_to_end_latency):,} ms\n'
             f' True End-to-end latency: {round(true_end_to_end_latency):,} ms\n'
+            '\n'
+            f' Missed input rate: {self.misses:,} time(s), {misses_in_window:,} in the steady state, '
+            f'by {len(json_data["saturated-clients"])} client(s)\n'
+            f' Batch fill: {json_data["batch-fill-avg"] * 100:,.1f} % of {batch_size:,} B, '
+            f'{json_data["batch-timeout-share"] * 100:,.1f} % of {len(batch_fill):,} batch(es) sealed by timeout\n'
             '-----------------------------------------\n'
         )
 
@@ -425,18 +889,9 @@ class LogParser:
     def process(cls, directory, faults=0):
         assert isinstance(directory, str)
 
-        clients = []
-        for filename in sorted(glob(join(directory, 'client-*.log'))):
-            with open(filename, 'r') as f:
-                clients += [f.read()]
-        primaries = []
-        for filename in sorted(glob(join(directory, 'primary-*.log'))):
-            with open(filename, 'r') as f:
-                primaries += [f.read()]
-        workers = []
-        for filename in sorted(glob(join(directory, 'worker-*.log'))):
-            with open(filename, 'r') as f:
-                workers += [f.read()]
+        clients = sorted(archive.glob(join(directory, 'client-*.log')))
+        primaries = sorted(archive.glob(join(directory, 'primary-*.log')))
+        workers = sorted(archive.glob(join(directory, 'worker-*.log')))
 
         return cls(clients, primaries, workers, faults=faults)
 
@@ -444,36 +899,26 @@ class LogParser:
     def chop_process(cls, directory, faults=0):
         assert isinstance(directory, str)
 
-        clients = []
-        for filename in sorted(glob(join(directory, 'honest_client_*.err'), recursive=True)):
-            with open(filename, 'r') as f:
-                clients += [f.read()]
-        primaries = []
-        for filename in sorted(glob(join(directory, 'server_*.err'), recursive=True)):
-            with open(filename, 'r') as f:
-                primaries += [f.read()]
-        workers = []
-        for filename in sorted(glob(join(directory, 'server_*.err'), recursive=True)):
-            with open(filename, 'r') as f:
-                workers += [f.read()]
+        clients = sorted(archive.glob(join(directory, 'honest_client_*.err')))
         # PLR: add both server and worker logs to consider all throughput
-        for filename in sorted(glob(join(directory, 'worker_*.err'), recursive=True)):
-            with open(filename, 'r') as f:
-                workers += [f.read()]
+        servers = sorted(archive.glob(join(directory, 'server_*.err')))
+        workers = sorted(archive.glob(join(directory, 'worker_*.err')))
 
-        return cls(clients, primaries, workers, faults=faults)
+        return cls(clients, [], workers, faults=faults, servers=servers)
 
 
 '''
 Print a summary of the logs
 Example Usage: python3 extract_bullshark.py comma-64-baselines/bullshark_64-500000_64-200000_16-1_88_1_2022-12-09-17-40-10_3_eu-west-2/
+Add --format=dist to write the compact binary format of distribution.py instead of json.
 '''
 try:
-    n = len(sys.argv)
-    if n < 2:
+    args = [x for x in sys.argv[1:] if not x.startswith('--format=')]
+    formats = [x.split('=', 1)[1] for x in sys.argv[1:] if x.startswith('--format=')]
+    if len(args) < 1:
         print("Must provide the logs directory path")
     else:
-        print(LogParser.chop_process(sys.argv[1], faults='?').result())
+        print(LogParser.chop_process(args[0], faults='?').result(args[0], formats[-1] if formats else 'json'))
 except ParseError as e:
     pass
 
@@ -2,7 +2,22 @@
 
 import subprocess
 import os
+import hashlib
 import json
+import array
+import re
+import sqlite3
+import threading
+import time
+import argparse
+import numpy as np
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+### local import
+import archive
+import distribution
+import timeline
 
 
 #####
@@ -12,46 +27,193 @@ import json
 HW_INTERFACE = "ens5"
 DIR_CHOPCHOP = "/home/ubuntu/chop-chop"
 DIR_RESULT = "/home/ubuntu/result"
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extract_chopchop.json") # experiment matrix, directories are relative to DIR_RESULT
+PARALLELISM = os.cpu_count() # heartbeat_statistics processes running at the same time
+TIMEOUT = 600 # seconds before a heartbeat_statistics process is killed
+DIR_CACHE = ".cache" # heartbeat_statistics results and result tree indexes reused across runs
+CACHE_MAX_ENTRIES = 1000000 # least recently used entries are evicted above this
+CACHE_MAX_AGE = 90 # days before an unused entry is evicted
+OUTPUT_FORMAT = "json" # "json", or "dist" for the compact binary format of distribution.py
+THROUGHPUT_WINDOW = [30, 60] # fixed [start, duration] in seconds (one heartbeat_statistics call per file), or "auto" to measure each heartbeat over its steady state (see timeline.py)
+DEFAULT_WINDOW = [30, 60] # used when no steady state is found
+TIMELINE_STEP = 1 # seconds per heartbeat_statistics call of the delivery timelines of "auto", and resolution of the detected windows
+
+
+def heartbeat_arguments(start, duration):
+    if start is None:
+        return []
+    return ["--start", str(start), "--duration", str(duration)]
+
+
+def heartbeat_statistics(heartbeat_path, start=None, duration=None):
+    """ Run heartbeat_statistics on a file and find the deliveries line: (number of messages, Mops) """
+    arguments = heartbeat_arguments(start, duration)
+    with archive.localpath(heartbeat_path) as path:
+        stdout = subprocess.run([DIR_CHOPCHOP + "/target/release/heartbeat_statistics", "--shallow-server", path] + arguments, stdout = subprocess.PIPE, stderr = subprocess.DEVNULL, timeout = TIMEOUT).stdout
+    stdout = stdout.decode(errors = "replace")
+    stdout = stdout.split("\n")
+
+    for line in stdout:
+        if "Deliveries:" in line:
+            messages = int(line.split(":")[1].split("(")[0])
+            mops = float(line.split("(")[1].split("Mops")[0])
+            return messages, mops
+
+    raise ValueError("Malformed heartbeat output: " + heartbeat_path)
+
+
+#####
+##### Cache of heartbeat_statistics results
+#####
+
+cache_connection = None
+cache_lock = threading.Lock()
+cache_hits = 0
+cache_misses = 0
+
+
+def open_cache():
+    global cache_connection
+
+    if cache_connection is None:
+        os.makedirs(DIR_CACHE, exist_ok = True)
+        cache_connection = sqlite3.connect(DIR_CACHE + "/heartbeat_statistics.sqlite", timeout = TIMEOUT, check_same_thread = False)
+        cache_connection.execute("CREATE TABLE IF NOT EXISTS deliveries (path TEXT, size INTEGER, mtime INTEGER, arguments TEXT, messages INTEGER, mops REAL, used REAL, PRIMARY KEY (path, size, mtime, arguments))")
+        cache_connection.commit()
+
+    return cache_connection
+
+
+def cached_heartbeat_statistics(heartbeat_path, start=None, duration=None):
+    """ Same as heartbeat_statistics, but each (path, size, mtime, arguments) is only decoded once """
+    return cached_heartbeat_windows(heartbeat_path, [(start, duration)])[0]
+
+
+def cached_heartbeat_windows(heartbeat_path, windows):
+    """ Cached heartbeat_statistics of several (start, duration) windows of a file, an archived file is only copied once for all of them """
+    global cache_hits, cache_misses
+
+    stat = archive.stat(heartbeat_path)
+    keys = [(os.path.abspath(heartbeat_path), stat.st_size, stat.st_mtime_ns, " ".join(heartbeat_arguments(start, duration))) for start, duration in windows]
+    results = [None] * len(windows)
+
+    with cache_lock:
+        connection = open_cache()
+        for i, key in enumerate(keys):
+            row = connection.execute("SELECT messages, mops FROM deliveries WHERE path = ? AND size = ? AND mtime = ? AND arguments = ?", key).fetchone()
+            if row is not None:
+                results[i] = (row[0], row[1])
+                connection.execute("UPDATE deliveries SET used = ? WHERE path = ? AND size = ? AND mtime = ? AND arguments = ?", (time.time(),) + key)
+        connection.commit() # release the write lock, other jobs share the cache
+        missing = [i for i, result in enumerate(results) if result is None]
+        cache_hits += len(windows) - len(missing)
+        cache_misses += len(missing)
+
+    if not missing:
+        return results
+
+    with archive.localpath(heartbeat_path) as path:
+        for i in missing:
+            results[i] = heartbeat_statistics(path, *windows[i])
+
+    with cache_lock:
+        connection = open_cache()
+        connection.executemany("INSERT OR REPLACE INTO deliveries VALUES (?, ?, ?, ?, ?, ?, ?)", [keys[i] + results[i] + (time.time(),) for i in missing])
+        connection.commit()
+
+    return results
+
+
+def close_cache(evict = True):
+    """ Evict old and least recently used entries, then report hits and misses """
+    global cache_connection, cache_hits, cache_misses
+
+    if cache_connection is None and not evict:
+        return
+
+    with cache_lock:
+        connection = open_cache()
+        evicted = 0
+        if evict:
+            evicted += connection.execute("DELETE FROM deliveries WHERE used < ?", (time.time() - CACHE_MAX_AGE * 24 * 3600,)).rowcount
+            evicted += connection.execute("DELETE FROM deliveries WHERE rowid NOT IN (SELECT rowid FROM deliveries ORDER BY used DESC LIMIT ?)", (CACHE_MAX_ENTRIES,)).rowcount
+        entries = connection.execute("SELECT COUNT(*) FROM deliveries").fetchone()[0]
+        connection.commit()
+        connection.close()
+        cache_connection = None
+
+    print("Heartbeat cache: {} hits, {} misses, {} evicted, {} entries".format(cache_hits, cache_misses, evicted, entries))
+    cache_hits = 0
+    cache_misses = 0
+
+
+def heartbeat_timeline(heartbeat_path):
+    """ Number of messages delivered during each TIMELINE_STEP seconds of a file """
+    ### A couple of extra seconds make up for the rounding of the Mops
+    messages, mops = cached_heartbeat_statistics(heartbeat_path)
+    steps = -(-(int(messages / mops / 10**6) + 2) // TIMELINE_STEP) if mops > 0 else 0
+    return [messages for messages, _ in cached_heartbeat_windows(heartbeat_path, [(step * TIMELINE_STEP, TIMELINE_STEP) for step in range(steps)])]
+
+
+def steady_throughput(heartbeat_path):
+    """ Find throughput value in a file over its steady state: (Mops, [start, duration], deliveries per TIMELINE_STEP seconds or None) """
+    deliveries = None
+
+    if THROUGHPUT_WINDOW == "auto":
+        ### Windows are whole steps of the timeline, whose deliveries are already known
+        deliveries = heartbeat_timeline(heartbeat_path)
+        steady = timeline.steadyState(deliveries, minimum = -(-timeline.STEADY_MINIMUM // TIMELINE_STEP))
+        if steady is not None:
+            start, duration = steady[0] * TIMELINE_STEP, steady[1] * TIMELINE_STEP
+            return sum(deliveries[steady[0]:steady[0] + steady[1]]) / duration / 10**6, [start, duration], deliveries
+        window = DEFAULT_WINDOW
+    else:
+        window = THROUGHPUT_WINDOW
+
+    start, duration = window
+    return cached_heartbeat_statistics(heartbeat_path, start, duration)[1], [start, duration], deliveries
 
 
 def output_throughput(heartbeat_path):
     """ Find throughput value in a file """
-    stdout = subprocess.run([DIR_CHOPCHOP + "/target/release/heartbeat_statistics", "--shallow-server", heartbeat_path, "--start", "30", "--duration", "60"], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL).stdout
-    stdout = str(stdout)
-    stdout = stdout.split("\n")
-    
-    for line in stdout:
-        if "Deliveries:" in line:
-            return float(line.split("(")[1].split("Mops")[0])
-    
-    raise "Malformed heartbeat output!"
+    return steady_throughput(heartbeat_path)[0]
 
 
 def total_messages(heartbeat_path):
     """ Find number of messages delivered in a file """
-    stdout = subprocess.run([DIR_CHOPCHOP + "/target/release/heartbeat_statistics", "--shallow-server", heartbeat_path], stdout = subprocess.PIPE, stderr = subprocess.DEVNULL).stdout
-    stdout = str(stdout)
-    stdout = stdout.split("\n")
+    return cached_heartbeat_statistics(heartbeat_path)[0]
 
-    for line in stdout:
-        if "Deliveries:" in line:
-            return int(line.split(":")[1].split("(")[0])
 
-    raise "Malformed heartbeat output!"
+LATENCY_PATTERN = re.compile(rb"Message delivered![^\n]*?Took (\d+)ms")
+CHUNK_SIZE = 16 * 1024 * 1024 # bytes of a log read at once
 
 
 def latencies(log_path):
-    """ Find all latencies in a file """
-    lines = open(log_path).readlines()
-    deliveries = [line for line in lines if "Message delivered!" in line]
-    latencies = [int(line.split("Took")[1].split("ms")[0]) for line in deliveries]
-    
+    """ Find all latencies in a file, reading it chunk by chunk """
+    latencies = array.array("q")
+    tail = b""
+
+    with archive.open(log_path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+
+            ### Only scan complete lines, the last partial line is carried over to the next chunk
+            chunk = tail + chunk
+            end = chunk.rfind(b"\n") + 1
+            latencies.extend(map(int, LATENCY_PATTERN.findall(chunk, 0, end)))
+            tail = chunk[end:]
+
+    latencies.extend(map(int, LATENCY_PATTERN.findall(tail)))
     return latencies
 
 
 def network_transfer(before_path, after_path):
-    before_lines = open(before_path).readlines()
-    after_lines = open(after_path).readlines()
+    with archive.open(before_path) as f:
+        before_lines = f.readlines()
+    with archive.open(after_path) as f:
+        after_lines = f.readlines()
 
     befores = [line for line in before_lines if HW_INTERFACE + ":rx_bytes:" in line]
     afters = [line for line in after_lines if HW_INTERFACE + ":rx_bytes:" in line]
@@ -62,6 +224,98 @@ def network_transfer(before_path, after_path):
     return after - before
 
 
+#####
+##### Index of the result tree
+#####
+
+indexes = {}
+
+
+def write_atomically(filename, contents):
+    """ Replace a file by contents, readers see either the old or the new file """
+    directory = os.path.dirname(filename) or "."
+    os.makedirs(directory, exist_ok = True)
+    tmp = "{}/.{}.{}.tmp".format(directory, os.path.basename(filename), os.getpid())
+    with open(tmp, 'w') as f:
+        f.write(contents)
+    os.replace(tmp, filename)
+
+
+def scan_vault(vault_path):
+    """ List the processes of a vault and their files: {process: {"mtime": ..., "files": [...]}} """
+    processes = {}
+    with archive.scandir(vault_path) as it:
+        for entry in it:
+            if entry.is_dir():
+                with archive.scandir(entry.path) as files:
+                    processes[entry.name] = {"mtime": entry.stat().st_mtime_ns, "files": sorted(file.name for file in files)}
+    return processes
+
+
+def vault_unchanged(vault_path, vault):
+    try:
+        return all(archive.stat(vault_path + "/" + process).st_mtime_ns == vault["processes"][process]["mtime"] for process in vault["processes"])
+    except FileNotFoundError:
+        return False
+
+
+def index_path(base_path):
+    """ Index file of a base path, named after a hash of the path """
+    return "{}/index/{}.json".format(DIR_CACHE, hashlib.sha1(base_path.encode()).hexdigest())
+
+
+def index_result_tree(base_path):
+    """
+    Walk base_path (a directory or a path inside an archive) once: {vault: {"mtime": ..., "processes": {process: {"mtime": ..., "files": [...]}}}}.
+    The index is kept in memory and in one file per base path in DIR_CACHE/index/, vaults whose directories did not change are not listed again.
+    Jobs indexing different base paths never write the same file, and jobs indexing the same one write the same index.
+    """
+    base_path = os.path.abspath(base_path)
+    if base_path in indexes:
+        return indexes[base_path]
+
+    index_file = index_path(base_path)
+    previous = {}
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            previous = json.load(f)
+
+    index = {}
+    rescanned = 0
+    with archive.scandir(base_path) as it:
+        for entry in sorted(it, key = lambda entry: entry.name):
+            if not entry.is_dir():
+                continue
+            mtime = entry.stat().st_mtime_ns
+            vault = previous.get(entry.name)
+            if vault is None or vault["mtime"] != mtime or not vault_unchanged(entry.path, vault):
+                vault = {"mtime": mtime, "processes": scan_vault(entry.path)}
+                rescanned += 1
+            index[entry.name] = vault
+
+    if rescanned > 0 or len(index) != len(previous):
+        write_atomically(index_file, json.dumps(index))
+    print("Indexed {}: {} vaults ({} listed)".format(base_path, len(index), rescanned))
+
+    indexes[base_path] = index
+    return index
+
+
+def indexed_processes(base_path, broadcast, vault_filters, role):
+    """ Processes of a role (e.g. "result_server_") in the vaults matching broadcast and all filters: [(vault, process path, files)] """
+    processes = []
+
+    for vault_name, vault in index_result_tree(base_path).items():
+        if broadcast not in vault_name or not all(vault_filter in vault_name for vault_filter in vault_filters):
+            continue
+
+        for process_name, process in sorted(vault["processes"].items()):
+            if role in process_name:
+                processes.append((vault_name, base_path + "/" + vault_name + "/" + process_name, process["files"]))
+
+    return processes
+
+
 def heartbeat_paths(broadcast, load_broker_throughput, base_path, matching_trusted):
     # Careful: include in the filter the batch size of the TOB.
     # We had one run that did not have a correct batch size and should be thrown away.
@@ -71,25 +325,12 @@ def heartbeat_paths(broadcast, load_broker_throughput, base_path, matching_trust
 
     heartbeat_paths = []
 
-    vaults = os.listdir(base_path)
-    vaults = [vault for vault in vaults if broadcast in vault]
-    vaults = [vault for vault in vaults if load_broker_throughput_filter in vault]
-
-    for vault in vaults:
-        vault_path = base_path + "/" + vault
-
-        processes = os.listdir(vault_path)
-        servers = [process for process in processes if "result_server_" in process]
-        
-        for server in servers:
-            server_path = vault_path + "/" + server
-
-            heartbeats = os.listdir(server_path)
-            heartbeats = [heartbeat for heartbeat in heartbeats if ".bin" in heartbeat]
+    for _, server_path, files in indexed_processes(base_path, broadcast, [load_broker_throughput_filter], "result_server_"):
+        heartbeats = [heartbeat for heartbeat in files if ".bin" in heartbeat]
 
-            for heartbeat in heartbeats:
-                heartbeat_path = server_path + "/" + heartbeat
-                heartbeat_paths.append(heartbeat_path)
+        for heartbeat in heartbeats:
+            heartbeat_path = server_path + "/" + heartbeat
+            heartbeat_paths.append(heartbeat_path)
     
     return heartbeat_paths
 
@@ -99,25 +340,12 @@ def client_log_paths(broadcast, load_broker_throughput, base_path):
 
     heartbeat_paths = []
 
-    vaults = os.listdir(base_path)
-    vaults = [vault for vault in vaults if broadcast in vault]
-    vaults = [vault for vault in vaults if load_broker_throughput_filter in vault]
+    for _, client_path, files in indexed_processes(base_path, broadcast, [load_broker_throughput_filter], "result_honest-client_"):
+        heartbeats = [heartbeat for heartbeat in files if ".err" in heartbeat]
 
-    for vault in vaults:
-        vault_path = base_path + "/" + vault
-
-        processes = os.listdir(vault_path)
-        clients = [process for process in processes if "result_honest-client_" in process]
-        
-        for client in clients:
-            client_path = vault_path + "/" + client
-
-            heartbeats = os.listdir(client_path)
-            heartbeats = [heartbeat for heartbeat in heartbeats if ".err" in heartbeat]
-
-            for heartbeat in heartbeats:
-                heartbeat_path = client_path + "/" + heartbeat
-                heartbeat_paths.append(heartbeat_path)
+        for heartbeat in heartbeats:
+            heartbeat_path = client_path + "/" + heartbeat
+            heartbeat_paths.append(heartbeat_path)
     
     return heartbeat_paths
 
@@ -128,71 +356,184 @@ def linerate_paths(broadcast, load_broker_throughput, base_path):
 
     linerate_paths = []
 
-    vaults = os.listdir(base_path)
-    vaults = [vault for vault in vaults if broadcast in vault]
-    vaults = [vault for vault in vaults if load_broker_throughput_filter in vault and secondary_filter in vault]
-
-    for vault in vaults:
-        vault_path = base_path + "/" + vault
-
-        processes = os.listdir(vault_path)
-        servers = [process for process in processes if "result_server_" in process]
-
-        for server in servers:
-            server_path = vault_path + "/" + server
+    for _, server_path, files in indexed_processes(base_path, broadcast, [load_broker_throughput_filter, secondary_filter], "result_server_"):
+        heartbeats = [file for file in files if ".bin" in file]
+        befores = [file for file in files if ".before" in file]
+        afters = [file for file in files if ".after" in file]
 
-            files = os.listdir(server_path)
+        if len(heartbeats) > 1:
+            print("WHAT THE HELL??")
+        elif len(heartbeats) > 0:
+            heartbeat = server_path + "/" + heartbeats[0]
+            before = server_path + "/" + befores[0]
+            after = server_path + "/" + afters[0]
 
-            heartbeats = [file for file in files if ".bin" in file]
-            befores = [file for file in files if ".before" in file]
-            afters = [file for file in files if ".after" in file]
+            linerate_paths.append({"heartbeat": heartbeat, "before": before, "after": after})
 
-            if len(heartbeats) > 1:
-                print("WHAT THE HELL??")
-            elif len(heartbeats) > 0:
-                heartbeat = server_path + "/" + heartbeats[0]
-                before = server_path + "/" + befores[0]
-                after = server_path + "/" + afters[0]
+    return linerate_paths
 
-                linerate_paths.append({"heartbeat": heartbeat, "before": before, "after": after})
 
-    return linerate_paths
+def run_parallel(function, items):
+    """ Apply function to all items with at most PARALLELISM calls at a time, results keep the order of items """
+    with ThreadPoolExecutor(max_workers=PARALLELISM) as executor:
+        return list(executor.map(function, items))
 
 
 def dump_to_json(plot, filename):
-    contents = json.dumps(plot)
-    with open(filename, 'a') as f:
-        f.write(contents)
+    contents = json.dumps(plot, default = lambda values: values.tolist()) # arrays of latencies
+    write_atomically(filename, contents)
     print("Created json file: " + filename)
     # print("\n\n\n")
     # print(contents)
 
 
+def dump(plot, output):
+    """ Write an output in OUTPUT_FORMAT """
+    if OUTPUT_FORMAT == "json":
+        dump_to_json(plot, output)
+        return
+
+    filename = os.path.splitext(output)[0] + ".dist"
+    tmp = "{}.{}.tmp".format(filename, os.getpid())
+    distribution.saveNested(tmp, plot, {"system": "chopchop", "output": os.path.splitext(output)[0]})
+    os.replace(tmp, filename)
+    print("Created dist file: " + filename)
+
+
+#####
+##### Manifest of the vaults already extracted
+#####
+
+def load_manifest(output):
+    """ Per-vault results already in an output: {"output": ..., "window": ..., "step": ..., "results": {key: {vault: {"files": ..., "values": [...]}}}} """
+    manifest_file = DIR_CACHE + "/manifest/" + output
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        if manifest.get("window") == str(THROUGHPUT_WINDOW) and manifest.get("step") == TIMELINE_STEP:
+            return manifest
+    return {"output": output, "window": str(THROUGHPUT_WINDOW), "step": TIMELINE_STEP, "results": {}}
+
+
+def save_manifest(manifest):
+    write_atomically(DIR_CACHE + "/manifest/" + manifest["output"], json.dumps(manifest))
+
+
+def file_signature(base_path, paths):
+    """ Identity of files: [[path relative to base_path, size, mtime], ...] """
+    signature = []
+    for path in paths:
+        stat = archive.stat(path)
+        signature.append([os.path.relpath(path, base_path), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def sidecar_path(manifest, key, vault):
+    """ Distribution file of the results of a vault, next to the manifest """
+    return "{}/manifest/{}/{}/{}.dist".format(DIR_CACHE, os.path.splitext(manifest["output"])[0], key.replace(" ", "_"), vault)
+
+
+def save_sidecar(filename, values):
+    tmp = "{}.{}.tmp".format(filename, os.getpid())
+    os.makedirs(os.path.dirname(filename), exist_ok = True)
+    distribution.save(tmp, {str(i): value for i, value in enumerate(values)})
+    os.replace(tmp, filename)
+
+
+def load_sidecar(filename):
+    columns = distribution.load(filename)[1]
+    return [columns[str(i)] for i in range(len(columns))]
+
+
+def extract_incrementally(manifest, key, base_path, items, item_files, extract, sidecar = False):
+    """
+    Results of extract(items), one per item, for one (broadcast, input throughput) of an output.
+    Vaults whose files did not change since the last run are taken from the manifest,
+    only the items of new or changed vaults are extracted, and vaults that disappeared are dropped.
+    With sidecar, results are arrays kept in one .dist file per vault and the manifest only refers to it.
+    """
+    vaults = {}
+    for item in items:
+        vault = os.path.relpath(item_files(item)[0], base_path).split("/")[0]
+        vaults.setdefault(vault, []).append(item)
+
+    previous = manifest["results"].get(key, {})
+    current = {}
+    changed = []
+    for vault, vault_items in vaults.items():
+        signature = file_signature(base_path, [path for item in vault_items for path in item_files(item)])
+        if vault in previous and previous[vault]["files"] == signature and ("sidecar" in previous[vault]) == sidecar:
+            current[vault] = previous[vault]
+        else:
+            current[vault] = {"files": signature, "values": []}
+            changed.append(vault)
+
+    ### Extract all new items at once to keep the worker pool busy
+    changed_items = [item for vault in changed for item in vaults[vault]]
+    changed_values = iter(extract(changed_items))
+    values = {}
+    for vault in changed:
+        values[vault] = [next(changed_values) for _ in vaults[vault]]
+        if sidecar:
+            current[vault] = {"files": current[vault]["files"], "sidecar": sidecar_path(manifest, key, vault)}
+            save_sidecar(current[vault]["sidecar"], values[vault])
+        else:
+            current[vault]["values"] = values[vault]
+
+    removed = [vault for vault in previous if vault not in current]
+    for vault in removed:
+        if "sidecar" in previous[vault] and os.path.exists(previous[vault]["sidecar"]):
+            os.remove(previous[vault]["sidecar"])
+    print("{} {}: {} vaults reused, {} extracted, {} removed".format(manifest["output"], key, len(vaults) - len(changed), len(changed), len(removed)))
+
+    manifest["results"][key] = current
+    if sidecar:
+        return [value for vault in vaults for value in (values[vault] if vault in values else load_sidecar(current[vault]["sidecar"]))]
+    return [value for vault in vaults for value in current[vault]["values"]]
+
+
 ######## Throughputs ########
 def compute_throughput(base_path, input_rates, destination, payload_size, matching_trusted):
     plot = {}
+    timelines = {}
+    output = 'throughput_' + destination + '.json'
+    manifest = load_manifest(output)
+
+    def extract(paths):
+        return [[os.path.relpath(path, base_path)] + list(values) for path, values in zip(paths, run_parallel(steady_throughput, paths))]
 
     for broadcast in ["bftsmart", "hotstuff"]:
         plot[broadcast] = {}
+        timelines[broadcast] = {}
         
         for load_broker_throughput in input_rates:
             input_throughput = load_broker_throughput + 432000. / payload_size * 8
             input_throughput = float(input_throughput) / 1000000.
 
             plot[broadcast][input_throughput] = []
+            timelines[broadcast][input_throughput] = []
 
-            for heartbeat_path in heartbeat_paths(broadcast, load_broker_throughput, base_path, matching_trusted):
-                output_throughput_value = output_throughput(heartbeat_path) / payload_size * 8
+            paths = heartbeat_paths(broadcast, load_broker_throughput, base_path, matching_trusted)
+            key = "{} {}".format(broadcast, load_broker_throughput)
+            for path, output_throughput_value, window, deliveries in extract_incrementally(manifest, key, base_path, paths, lambda path: [path], extract):
+                output_throughput_value = output_throughput_value / payload_size * 8
                 plot[broadcast][input_throughput].append(output_throughput_value)
+                if deliveries is not None:
+                    timelines[broadcast][input_throughput].append({"heartbeat": path, "window": window, "step": TIMELINE_STEP, "deliveries": deliveries})
 
                 # print(broadcast + " @ " + str(input_throughput) + " -> " + str(output_throughput_value))
 
-    dump_to_json(plot, 'throughput_' + destination + '.json')
+    dump(plot, output)
+    if THROUGHPUT_WINDOW == "auto":
+        dump_to_json(timelines, 'timeline_' + destination + '.json') # deliveries per TIMELINE_STEP seconds and measured window of each heartbeat
+    save_manifest(manifest)
 
 
 ####### Latencies ########
 def compute_latency(base_path, input_rates, destination, payload_size):
     plot = {}
+    output = 'latency_' + destination + '.json'
+    manifest = load_manifest(output)
 
     for broadcast in ["bftsmart", "hotstuff"]:
         plot[broadcast] = {}
@@ -201,22 +542,33 @@ def compute_latency(base_path, input_rates, destination, payload_size):
             input_throughput = load_broker_throughput + 432000 / payload_size * 8.
             input_throughput = float(input_throughput) / 1000000.
 
-            plot[broadcast][input_throughput] = []
-
-            for client_log_path in client_log_paths(broadcast, load_broker_throughput, base_path):
-                latencies_values = latencies(client_log_path)
+            latencies_all = [np.zeros(0, dtype = np.int64)]
 
-                for latency in latencies_values:
-                    plot[broadcast][input_throughput].append(latency)
+            paths = client_log_paths(broadcast, load_broker_throughput, base_path)
+            key = "{} {}".format(broadcast, load_broker_throughput)
+            for latencies_values in extract_incrementally(manifest, key, base_path, paths, lambda path: [path], lambda paths: [latencies(path) for path in paths], sidecar = True):
+                latencies_all.append(np.asarray(latencies_values, dtype = np.int64))
 
                 # print(broadcast + " @ " + str(input_throughput) + " -> " + str(latencies_values))
 
-    dump_to_json(plot, 'latency_' + destination + '.json')
+            plot[broadcast][input_throughput] = np.concatenate(latencies_all)
+
+    dump(plot, output)
+    save_manifest(manifest)
 
 
 ######## Linerate ########
 def compute_linerate(base_path, input_rates, destination, payload_size):
     plot = {}
+    output = 'linerate_' + destination + '.json'
+    manifest = load_manifest(output)
+
+    def extract(paths):
+        heartbeats = [linerate_path["heartbeat"] for linerate_path in paths]
+        output_throughput_values = run_parallel(output_throughput, heartbeats)
+        output_total_messages_values = run_parallel(total_messages, heartbeats)
+        network_transfer_values = [network_transfer(linerate_path["before"], linerate_path["after"]) for linerate_path in paths]
+        return [list(values) for values in zip(output_throughput_values, output_total_messages_values, network_transfer_values)]
 
     for broadcast in ["bftsmart", "hotstuff"]:
         plot[broadcast] = {}
@@ -227,53 +579,116 @@ def compute_linerate(base_path, input_rates, destination, payload_size):
 
             plot[broadcast][input_throughput] = []
 
-            for linerate_path in linerate_paths(broadcast, load_broker_throughput, base_path):
-                output_throughput_value = output_throughput(linerate_path["heartbeat"])
-                output_total_messages = total_messages(linerate_path["heartbeat"])
-                network_transfer_value = network_transfer(linerate_path["before"], linerate_path["after"])
+            paths = linerate_paths(broadcast, load_broker_throughput, base_path)
+            key = "{} {}".format(broadcast, load_broker_throughput)
+            item_files = lambda linerate_path: [linerate_path["heartbeat"], linerate_path["before"], linerate_path["after"]]
 
+            for output_throughput_value, output_total_messages, network_transfer_value in extract_incrementally(manifest, key, base_path, paths, item_files, extract):
                 goodput = float(output_total_messages) * 11.5 / float(network_transfer_value)
 
                 plot[broadcast][input_throughput].append({"output_throughput": output_throughput_value, "goodput": goodput})
 
                 # print(broadcast + " @ " + str(input_throughput) + " -> " + str(output_throughput_value) + "  (" + str(goodput) + ")")
 
-    dump_to_json(plot, 'linerate_' + destination + '.json')
+    dump(plot, output)
+    save_manifest(manifest)
 
 
 
 
 
 #####
-##### Throughput latency
+##### Experiment matrix
 #####
 
-ARGS = [
-    # Missing the smallest data point of the comma
-    (DIR_RESULT + "/comma", [10000000, 20000000, 30000000, 40000000, 45000000, 46000000, 47000000, 48000000], 'comma-chopchop', 8, False),
-    (DIR_RESULT + "/faults", [20000000, 44000000], 'faults', 8, False),
-    (DIR_RESULT + "/auction", [2000000], 'auction', 8, False),
-    (DIR_RESULT + "/payments", [32000000], 'payments', 8, False),
-    (DIR_RESULT + "/pixel_war", [35000000], 'pixel_war', 8, False),
-    (DIR_RESULT + "/payload-512", [900000], 'payload-512', 512, False),
-    (DIR_RESULT + "/payload-128", [4000000], 'payload-128', 128, False),
-    (DIR_RESULT + "/payload-32", [18000000], 'payload-32', 32, False),
-    # reduction-0 = no distillation
-    (DIR_RESULT + "/reduction-0", [1000000], 'reduction-0', 8, False),
-    (DIR_RESULT + "/system-32", [48000000], 'system-32', 8, False),
-    (DIR_RESULT + "/system-16", [45000000], 'system-16', 8, False),
-    (DIR_RESULT + "/system-8", [40000000], 'system-8', 8, False),
-    (DIR_RESULT + "/matching_trusted", [4600000], 'matching-trusted', 8, True),
-]
-
-for arg in ARGS:
-    compute_latency(arg[0], arg[1], arg[2], arg[3])
-    compute_throughput(arg[0], arg[1], arg[2], arg[3], arg[4])
+def matrix_jobs(configurations, names):
+    """ Independent jobs of the selected configurations: [(name, function, arguments)] """
+    unknown = [name for name in names if name not in [configuration["name"] for configuration in configurations]]
+    if unknown:
+        raise ValueError("Unknown configuration(s): " + ", ".join(unknown))
+
+    jobs = []
+    for configuration in configurations:
+        if names and configuration["name"] not in names:
+            continue
+
+        base_path = os.path.join(DIR_RESULT, configuration["directory"])
+        arguments = (base_path, configuration["input_rates"], configuration["name"], configuration["payload_size"])
+
+        if configuration["kind"] == "throughput-latency":
+            jobs.append((configuration["name"] + " latency", compute_latency, arguments))
+            jobs.append((configuration["name"] + " throughput", compute_throughput, arguments + (configuration["matching_trusted"],)))
+        elif configuration["kind"] == "linerate":
+            jobs.append((configuration["name"] + " linerate", compute_linerate, arguments))
+        else:
+            raise ValueError("Unknown kind of configuration: " + configuration["kind"])
+
+    return jobs
+
+
+def init_job(parallelism):
+    global PARALLELISM
+    PARALLELISM = parallelism
+
+
+def run_job(function, arguments):
+    """ Run a job in its pool process: the heartbeat cache hits and misses of the job """
+    function(*arguments)
+    counts = (cache_hits, cache_misses)
+    close_cache(evict = False)
+    return counts
+
+
+def run_matrix(config_file, names, jobs):
+    """ Run the jobs of the selected configurations, at most jobs of them at a time, each in its own process """
+    global cache_hits, cache_misses
+
+    with open(config_file) as f:
+        configurations = json.load(f)["configurations"]
+    matrix = matrix_jobs(configurations, names)
+
+    ### Decompress archived results once, the job processes inherit them
+    archive_path, _ = archive.split(DIR_RESULT)
+    if archive_path is not None:
+        archive.get(archive_path)
+
+    ### Share the heartbeat_statistics processes between the jobs running at the same time
+    parallelism = max(1, PARALLELISM // min(jobs, max(1, len(matrix))))
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers = jobs, initializer = init_job, initargs = (parallelism,)) as executor:
+        futures = {executor.submit(run_job, function, arguments): name for name, function, arguments in matrix}
+        for future in as_completed(futures):
+            try:
+                hits, misses = future.result()
+                cache_hits += hits
+                cache_misses += misses
+                print("Done: " + futures[future])
+            except Exception as e:
+                failures += 1
+                print("Failed: {} ({})".format(futures[future], repr(e)))
+
+    ### Report the hits and misses of all the jobs with the evictions
+    close_cache()
+    return failures
+
+
+
+
 
 #####
-##### Linerate
+##### Main
 #####
 
-ARGS = [(DIR_RESULT + "/linerate", [10000000, 20000000, 30000000, 40000000, 50000000, 60000000], "chopchop", 8)]
-for arg in ARGS:
-    compute_linerate(args[0], args[1], args[2], args[3])
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Extract the throughput, latency and line rate of Chop Chop runs into .json files")
+    parser.add_argument("names", nargs = "*", help = "names of the configurations to extract (default: all)")
+    parser.add_argument("--config", default = CONFIG, help = "experiment matrix (default: %(default)s)")
+    parser.add_argument("--jobs", type = int, default = os.cpu_count(), help = "configurations extracted at the same time (default: %(default)s)")
+    args = parser.parse_args()
+
+    try:
+        failures = run_matrix(args.config, args.names, args.jobs)
+    except ValueError as e:
+        parser.error(str(e))
+    sys.exit(1 if failures else 0)
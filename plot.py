@@ -11,6 +11,7 @@ import re
 import string
 
 # local import
+import distribution
 import utils
 
 
@@ -1029,6 +1030,73 @@ def plotLinerateThroughput(labelA, labelB, fileA, fileB):
 
     
 
+def plotTimeline(label, runFile, latencyFactor=10**3):
+    """ Per-second throughput and latency percentiles of one baseline run (output of extract_bftsmart_hotstuff.py), stalls shaded """
+    run = distribution.loadAny(runFile)
+    if "timeline-throughput" not in run:
+        print("No timeline in {} (its logs have no timestamps)".format(runFile))
+        return
+    throughputs = np.asarray(run["timeline-throughput"])
+    x = np.arange(len(throughputs))
+
+    fig, ax = plt.subplots(2, 1, sharex=True, **utils.FIG_SIZE_ONE_COL_SMALL)
+    utils.commonFigFormat(ax[0])
+    utils.commonFigFormat(ax[1])
+
+    ### Throughput on top, latency below (uniformize units: seconds -> milliseconds)
+    ax[0].plot(x, throughputs, label=label, color=LINE_FORMAT[label]["color"] if label in LINE_FORMAT else None)
+    ax[1].plot(x, np.asarray(run["timeline-latency-p50"]) * latencyFactor, label="p50", linestyle="solid", color="black")
+    ax[1].plot(x, np.asarray(run["timeline-latency-p99"]) * latencyFactor, label="p99", linestyle="dashed", color="black")
+
+    ### Stalls and measurement window
+    for start, duration in np.reshape(run["stalls"], (-1, 2)):
+        for a in ax:
+            a.axvspan(start, start + duration, color="tab:red", alpha=0.2, linewidth=0)
+    for a in ax:
+        a.axvline(run["window"][0], color="gray", linewidth=0.8)
+        a.axvline(run["window"][1], color="gray", linewidth=0.8)
+
+    ### Labels
+    ax[0].set_title(label)
+    ax[0].set_ylabel("op/s")
+    ax[1].set_ylabel("Lat. [ms]")
+    ax[1].set_xlabel("Time [s]")
+    ax[0].set_ylim(bottom=0)
+    ax[1].set_ylim(bottom=0)
+    ax[1].legend(**utils.FORMAT_LEGEND, ncol=2, loc="upper right")
+
+    utils.saveFig("timeline-{}".format(re.sub("[^a-zA-Z0-9]+", "-", label).strip("-").lower()))
+
+
+
+def plotBatchFill(labels, files):
+    """ Bullshark batch fill ratio (median, 5th-95th) and share of batches sealed by timeout, per load level (output of stats.py) """
+    fig, ax = plt.subplots(1, 2, **utils.FIG_SIZE_ONE_COL)
+    utils.commonFigFormat(ax[0])
+    utils.commonFigFormat(ax[1])
+
+    for i, file in enumerate(files):
+        csv = pd.read_csv(utils.DIR_STATS + "/" + file, index_col=0)
+        x = csv["workload"]
+        ax[0].errorbar(x, csv["batch fill 50th"] * 100,
+            yerr=[(csv["batch fill 50th"] - csv["batch fill 5th"]) * 100, (csv["batch fill 95th"] - csv["batch fill 50th"]) * 100],
+            label=labels[i], markerfacecolor="none", capsize=2, **LINE_FORMAT[labels[i]])
+        ax[1].plot(x, csv["batch timeout share avg"] * 100, label=labels[i], markerfacecolor="none", **LINE_FORMAT[labels[i]])
+
+    ### Full batches (sealed by size) sit at 100%
+    ax[0].axhline(100, color="gray", linewidth=0.8)
+
+    ax[0].set_ylabel("Batch fill [%]")
+    ax[1].set_ylabel("Sealed by timeout [%]")
+    for a in ax:
+        a.set_xlabel("Input rate [op/s]")
+        a.set_ylim(bottom=0)
+    ax[1].set_ylim(top=105)
+    ax[0].legend(**utils.FORMAT_LEGEND, ncol=len(labels), loc="center", bbox_to_anchor=(1.1, 1.2))
+
+    utils.saveFig("batch-fill")
+
+
 
 
 #####
@@ -1142,3 +1210,10 @@ if __name__ == "__main__":
         faultsLabels, filesNoFaults, filesFaults,
         appLabels, appFilesA, appFilesB, appFilesC
         )
+
+    ### Per-second timeline of a single baseline run, to tell stalls from uniform slowness
+    # plotTimeline("BFT-SMaRt", utils.DIR_DATA + "/comma-64-bftsmart/workload-<N>/<run>.json", latencyFactor=1) # bftsmart is already in millisec
+    # plotTimeline("HotStuff", utils.DIR_DATA + "/comma-64-hotstuff/workload-<N>/<run>.json")
+
+    ### Bullshark batch fill per load level, to tune batch_size and max_batch_delay
+    # plotBatchFill(["NW-Bullshark", "NW-Bullshark-sig"], ["comma-bullshark.csv", "comma-bullshark-sig.csv"])
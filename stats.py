@@ -17,6 +17,8 @@ import string
 import sys
 
 ### local import
+import archive
+import distribution
 import utils
 
 
@@ -28,7 +30,7 @@ import utils
 ##########
 
 OPERATIONS_SORTED_LIST = [
-    ("avg",  lambda x: sum([v for v in x]) / len(x) if len(x) > 0 else np.nan),
+    ("avg",  lambda x: np.mean(x)                   if len(x) > 0 else np.nan),
     ("std",  lambda x: np.std(x)                    if len(x) > 0 else np.nan),
     ("min",  lambda x: x[0]                         if len(x) > 0 else np.nan),
     ("1th",  lambda x: quantile(x, 0.01)            if len(x) > 0 else np.nan),
@@ -40,7 +42,7 @@ OPERATIONS_SORTED_LIST = [
     ("90th", lambda x: quantile(x, 0.90)            if len(x) > 0 else np.nan),
     ("95th", lambda x: quantile(x, 0.95)            if len(x) > 0 else np.nan),
     ("99th", lambda x: quantile(x, 0.99)            if len(x) > 0 else np.nan),
-    ("max",  lambda x: x[len(x) - 1]                if len(x) > 0 else np.nan),
+    ("max",  lambda x: x[-1]                        if len(x) > 0 else np.nan),
     ]
 
 
@@ -50,13 +52,13 @@ def quantile(N, percent, key=lambda x:x):
     """
     Find the quantile of a list of values.
 
-    @parameter N - is a list of values. Note N MUST BE already sorted.
+    @parameter N - is a list or NumPy array of values. Note N MUST BE already sorted.
     @parameter percent - a float value from 0.0 to 1.0.
     @parameter key - optional key function to compute value from each element of N.
 
     @return - the quantile of the values
     """
-    if not N:
+    if len(N) == 0:
         return None
     k = (len(N)-1) * percent
     f = math.floor(k)
@@ -67,9 +69,9 @@ def quantile(N, percent, key=lambda x:x):
     d1 = key(N[int(c)]) * (k-f)
     return d0+d1
 
-### Add a column to a dataframe per stat function for a given distribution
+### Add a column to a dataframe per stat function for a given distribution (list or NumPy array, sorted once as an array)
 def addStatsColumns(df, columnPrefix, distribution):
-    sortedDistribution = sorted(distribution)
+    sortedDistribution = np.sort(np.asarray(distribution))
     for label, function in OPERATIONS_SORTED_LIST:
         column = "{} {}".format(columnPrefix, label)
         df[column] = function(sortedDistribution)
@@ -82,20 +84,18 @@ def addStatsColumns(df, columnPrefix, distribution):
 ########## Parsing
 ##########
 
-def parseChopchopGeneric(csvPrefix, throughputFile, latencyFile):
+def parseChopchopGeneric(csvPrefix, throughputFile, latencyFile, timelineFile=None):
     """
     The two input files should have the same systems and workloads.
     Generates a csv with header ",system,workload,[op stats],[lat stats]".
     One row per workload. One csv file per system.
+    With the timeline file of extract_chopchop.py, the measured windows are added as "window start" and "window duration" stats.
     """
 
-    ### Read input files
-    throughput = None
-    latency = None
-    with open(throughputFile) as f:
-        throughput = json.load(f)
-    with open(latencyFile) as f:
-        latency = json.load(f)
+    ### Read input files (.json or .dist)
+    throughput = distribution.loadAny(throughputFile)
+    latency = distribution.loadAny(latencyFile)
+    timelines = distribution.loadAny(timelineFile) if timelineFile is not None else None
 
     ### One dataframe per system/baseline
     for system in throughput:
@@ -112,6 +112,9 @@ def parseChopchopGeneric(csvPrefix, throughputFile, latencyFile):
             ### Add a column per stat function for each distribution
             addStatsColumns(dfRow, "op", throughputs)
             addStatsColumns(dfRow, "lat", latency[system][workload])
+            if timelines is not None:
+                addStatsColumns(dfRow, "window start", [entry["window"][0] for entry in timelines[system][workload]])
+                addStatsColumns(dfRow, "window duration", [entry["window"][1] for entry in timelines[system][workload]])
 
             dfOut = pd.concat([dfOut, dfRow])
 
@@ -132,7 +135,7 @@ def parseBaselinesGeneric(csvPrefix, parameterKey, system, dataDir, latencyFacto
     # dataDirPath = os.path.join(os.path.dirname(sys.argv[0]), dataDir)
     dataDirPath = os.path.abspath(dataDir)
     dirs = []
-    with os.scandir(dataDirPath) as it:
+    with archive.scandir(dataDirPath) as it:
         for entry in it:
             if entry.name.startswith(parameterKey) and entry.is_dir():
                 dirs.append(entry.path)
@@ -145,15 +148,17 @@ def parseBaselinesGeneric(csvPrefix, parameterKey, system, dataDir, latencyFacto
         parameter = re.sub("{}-".format(parameterKey), "", dirName)
         parameter = int(parameter)
 
-        ### Fill data structure with each run's json
+        ### Fill data structure with each run's json, or its .dist equivalent when both exist
         allData[parameter] = []
-        with os.scandir(dirPath) as it:
+        with archive.scandir(dirPath) as it:
             # print(dirPath)
-            for entry in it:
-                if entry.name.endswith('.json') and entry.is_file():
-                    # print("{}/{}".format(dirPath,entry.name))
-                    with open(entry.path) as f:
-                        allData[parameter].append(json.load(f))
+            entries = [entry for entry in it if entry.name.endswith(('.json', '.dist')) and entry.is_file()]
+        names = set(entry.name for entry in entries)
+        for entry in entries:
+            if entry.name.endswith('.json') and entry.name[:-len('.json')] + '.dist' in names:
+                continue
+            # print("{}/{}".format(dirPath,entry.name))
+            allData[parameter].append(distribution.loadAny(entry.path))
 
     ### Fill dataframe used for csv output
     dfOut = pd.DataFrame()
@@ -170,13 +175,59 @@ def parseBaselinesGeneric(csvPrefix, parameterKey, system, dataDir, latencyFacto
         dfRow["op avg"] = np.mean(throughputs)
 
         ### Aggregate all latency values and add a column per stat function
-        latencies = []
-        for run in allData[parameter]:
-            for singleValue in run["latency"]:
-                # Uniformize units: seconds -> milliseconds
-                latencies.append(singleValue * latencyFactor)
+        # Uniformize units: seconds -> milliseconds
+        latencies = np.concatenate([np.asarray(run["latency"], dtype=float) for run in allData[parameter]] or [[]]) * latencyFactor
         addStatsColumns(dfRow, "lat", latencies)
 
+        ### HotStuff CPU time of each latency and the rest of it spent waiting (wall - cpu), same units as the latencies
+        if all("cpu" in run for run in allData[parameter]):
+            cpus = np.concatenate([np.asarray(run["cpu"], dtype=float) for run in allData[parameter]]) * latencyFactor
+            queueings = np.concatenate([np.asarray(run["queueing"], dtype=float) for run in allData[parameter]]) * latencyFactor
+            cpus, queueings = cpus[~np.isnan(cpus)], queueings[~np.isnan(queueings)]
+            if len(cpus) > 0:
+                addStatsColumns(dfRow, "cpu", cpus)
+                addStatsColumns(dfRow, "queueing", queueings)
+                dfRow["queueing share avg"] = queueings.sum() / (queueings.sum() + cpus.sum())
+
+        ### Bullshark consensus latency (header proposed to committed) against the end-to-end latency (sample sent to committed)
+        if all("consensus-latency" in run for run in allData[parameter]):
+            consensus = np.concatenate([np.asarray(run["consensus-latency"], dtype=float) for run in allData[parameter]]) * latencyFactor
+            endToEnd = np.concatenate([np.asarray(run["end-to-end-latency"], dtype=float) for run in allData[parameter]]) * latencyFactor
+            dfRow["consensus op avg"] = np.mean([run["consensus-throughput-avg"] for run in allData[parameter]])
+            dfRow["e2e op avg"] = np.mean([run["end-to-end-throughput-avg"] for run in allData[parameter]])
+            if len(consensus) > 0:
+                addStatsColumns(dfRow, "consensus lat", consensus)
+            if len(endToEnd) > 0:
+                addStatsColumns(dfRow, "e2e lat", endToEnd)
+            if len(consensus) > 0 and len(latencies) > 0:
+                dfRow["consensus share avg"] = consensus.mean() / latencies.mean()
+
+        ### Bullshark clock skew between hosts, to flag runs whose cross-host latencies are doubtful (NaN if unknown for a run)
+        if all("clock-skew" in run for run in allData[parameter]):
+            skews = [run["clock-skew"] for run in allData[parameter]]
+            dfRow["clock skew max"] = max(skews) * latencyFactor if None not in skews else np.nan
+
+        ### Bullshark clients that could not sustain their input rate ("rate too high"), over the run and in its measurement window
+        if all("timeline-misses" in run for run in allData[parameter]):
+            dfRow["misses avg"] = np.mean([run["misses"] for run in allData[parameter]])
+            dfRow["misses in window avg"] = np.mean([run["misses-in-window"] for run in allData[parameter]])
+            dfRow["saturated clients avg"] = np.mean([len(run["saturated-clients"]) for run in allData[parameter]])
+
+        ### Bullshark batch fill against the configured batch_size, and share of batches sealed by max_batch_delay
+        if all("batch-fill" in run for run in allData[parameter]):
+            fills = np.concatenate([np.asarray(run["batch-fill"], dtype=float) for run in allData[parameter]])
+            if len(fills) > 0:
+                addStatsColumns(dfRow, "batch fill", fills)
+                dfRow["batch timeout share avg"] = (fills < 1).mean()
+                dfRow["batches avg"] = len(fills) / len(allData[parameter])
+
+        ### Stalls of the runs (leader or view changes), when their timeline was extracted
+        if all("stalls" in run for run in allData[parameter]):
+            stallDurations = [[duration for _, duration in np.reshape(run["stalls"], (-1, 2))] for run in allData[parameter]]
+            dfRow["stalls avg"] = np.mean([len(durations) for durations in stallDurations])
+            dfRow["stall s avg"] = np.mean([sum(durations) for durations in stallDurations])
+            dfRow["stall s max"] = max([max(durations, default=0) for durations in stallDurations])
+
         ### Only linerate files contain server byte rates
         if withByteRate:
             outputRateOp = []
@@ -217,13 +268,9 @@ def parseBaselinesGeneric(csvPrefix, parameterKey, system, dataDir, latencyFacto
 
 
 def parseServerFaults(throughputFile, latencyFile):
-    ### Read input files
-    throughput = None
-    latency = None
-    with open(throughputFile) as f:
-        throughput = json.load(f)
-    with open(latencyFile) as f:
-        latency = json.load(f)
+    ### Read input files (.json or .dist)
+    throughput = distribution.loadAny(throughputFile)
+    latency = distribution.loadAny(latencyFile)
 
     ### Prepare to add number of faults in output
     faultLabels = ["threshold", "1"]
@@ -254,10 +301,8 @@ def parseServerFaults(throughputFile, latencyFile):
 
 
 def parseLinerateChopchop(file):
-    ### Read input file
-    data = None
-    with open(file) as f:
-        data = json.load(f)
+    ### Read input file (.json or .dist)
+    data = distribution.loadAny(file)
 
     ### One dataframe per system/baseline
     for system in data:
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+### Per-second timelines of a run, detection of its steady state (warm-up and cool-down excluded) and of its stalls
+
+import numpy as np
+
+
+STEADY_THRESHOLD = 0.9 # a second is steady when its rate reaches this fraction of the median rate of the run
+STEADY_MINIMUM = 10 # seconds, shorter steady states are not trusted
+STEADY_SMOOTHING = 5 # seconds of the rolling median applied to the rates before looking for a steady state
+STEADY_DEVIATIONS = 4 # noisy runs: a second is also steady when its smoothed rate is within this many deviations of the median rate
+STALL_FRACTION = 0.1 # a second stalls when its rate falls below this fraction of the median rate of the run (e.g. leader or view changes)
+STALL_MINIMUM = 1 # seconds, shorter drops are not reported
+
+
+def perSecond(times, weights=None, length=None):
+    """
+    Histogram of events per second.
+
+    @parameter times - time of each event in seconds since the start of the run
+    @parameter weights - number of operations of each event (1 each by default)
+    @parameter length - number of seconds of the timeline (up to the last event by default)
+
+    @return - array with the number of operations of each second
+    """
+    times = np.asarray(times, dtype=float)
+    if length is None:
+        length = int(np.floor(times.max())) + 1 if len(times) > 0 else 0
+    seconds = np.floor(times).astype(np.int64)
+    inside = (seconds >= 0) & (seconds < length)
+    weights = np.ones(len(times)) if weights is None else np.asarray(weights, dtype=float)
+    return np.bincount(seconds[inside], weights=weights[inside], minlength=length)[:length]
+
+
+def percentilesPerSecond(times, values, percentiles, length=None):
+    """
+    Percentiles of the values of the events of each second.
+
+    @parameter times - time of each event in seconds since the start of the run
+    @parameter values - value of each event (e.g. its latency)
+    @parameter percentiles - list of percentiles between 0 and 100
+
+    @return - array of shape (length, len(percentiles)), NaN for seconds without events
+    """
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if length is None:
+        length = int(np.floor(times.max())) + 1 if len(times) > 0 else 0
+    seconds = np.floor(times).astype(np.int64)
+    inside = (seconds >= 0) & (seconds < length)
+    seconds, values = seconds[inside], values[inside]
+
+    ### Sort by second then value, each second is then a contiguous slice
+    order = np.lexsort((values, seconds))
+    groups = np.split(values[order], np.cumsum(np.bincount(seconds, minlength=length))[:-1]) if length > 0 else []
+
+    result = np.full((length, len(percentiles)), np.nan)
+    for second, group in enumerate(groups):
+        if len(group) > 0:
+            result[second] = np.percentile(group, percentiles)
+    return result
+
+
+def rollingMedian(rates, width=STEADY_SMOOTHING):
+    """
+    Median of the rates over width seconds centered on each second (fewer seconds at both ends).
+
+    A median, unlike a mean, keeps the edges of a warm-up, a cool-down or a stall where they are.
+    """
+    rates = np.asarray(rates, dtype=float)
+    if width <= 1 or len(rates) == 0:
+        return rates
+    padded = np.concatenate((np.full(width // 2, np.nan), rates, np.full(width - 1 - width // 2, np.nan)))
+    return np.nanmedian(np.lib.stride_tricks.sliding_window_view(padded, width), axis=1)
+
+
+def steadyState(rates, threshold=STEADY_THRESHOLD, minimum=STEADY_MINIMUM, smoothing=STEADY_SMOOTHING):
+    """
+    Longest run of consecutive seconds whose smoothed rate stays above threshold times the median rate of the busy seconds.
+
+    At low rates (e.g. tens of operations per second), the rate of a steady run fluctuates by more than 1 - threshold
+    from one second to the next: the rates are smoothed by a rolling median, and the bar is lowered to
+    STEADY_DEVIATIONS robust deviations of the smoothed rates when these are noisier (never below half the median).
+
+    @parameter rates - number of operations of each second (see perSecond)
+
+    @return - (start, duration) in seconds, None when no run lasts at least minimum seconds
+    """
+    rates = np.asarray(rates, dtype=float)
+    busy = rates > 0
+    if not busy.any():
+        return None
+
+    smoothed = rollingMedian(rates, smoothing)
+    median = np.median(rates[busy])
+    deviation = 1.4826 * np.median(np.abs(smoothed[busy] - median)) # standard deviation of normal noise
+    level = max(min(threshold * median, median - STEADY_DEVIATIONS * deviation), median / 2)
+
+    steady = np.concatenate(([False], smoothed >= level, [False]))
+    edges = np.flatnonzero(np.diff(steady.astype(np.int8)))
+    starts, ends = edges[0::2], edges[1::2]
+    longest = np.argmax(ends - starts)
+    if ends[longest] - starts[longest] < minimum:
+        return None
+    return int(starts[longest]), int(ends[longest] - starts[longest])
+
+
+def stalls(rates, fraction=STALL_FRACTION, minimum=STALL_MINIMUM):
+    """
+    Runs of consecutive seconds whose rate falls below fraction times the median rate of the busy seconds.
+
+    @parameter rates - number of operations of each second (see perSecond), from the first to the last operation
+
+    @return - list of (start, duration) in seconds
+    """
+    rates = np.asarray(rates, dtype=float)
+    busy = rates[rates > 0]
+    if len(busy) == 0:
+        return []
+
+    stalled = np.concatenate(([False], rates < fraction * np.median(busy), [False]))
+    edges = np.flatnonzero(np.diff(stalled.astype(np.int8)))
+    return [(int(start), int(end - start)) for start, end in zip(edges[0::2], edges[1::2]) if end - start >= minimum]
@@ -11,6 +11,8 @@ import sys
 
 DIR_FIG = "figs"
 DIR_DATA = "agg-data"
+if not os.path.isdir(DIR_DATA) and os.path.isfile(DIR_DATA + ".tar.xz"):
+    DIR_DATA = DIR_DATA + ".tar.xz/" + DIR_DATA # read straight from the archive, see archive.py
 DIR_STATS = "stats"
 
 FORMAT_LEGEND = dict(framealpha=1, handletextpad=0.5, edgecolor="black")